@@ -0,0 +1,108 @@
+import unittest
+import struct
+from io import BytesIO
+from vredditshare.utils.container_info import read_container, container_type, ContainerParseError, MP4, WEBM
+
+
+def box(box_type, *children):
+    payload = b"".join(children)
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def trak(track_id, handler, codec, timescale, duration, stts=b"", width=0, height=0, extra=b""):
+    tkhd = struct.pack(">IIIII", 0, 0, track_id, 0, duration) + b"\0" * 52 + struct.pack(">II", width << 16,
+                                                                                        height << 16)
+    sample_entry = b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 16 + struct.pack(">HH", width, height) + b"\0" * 50
+    stsd = full_box(b"stsd", struct.pack(">I", 1) + box(codec, sample_entry))
+    stbl = box(b"stbl", stsd, full_box(b"stts", stts))
+    return box(b"trak", full_box(b"tkhd", tkhd), box(b"mdia",
+               full_box(b"mdhd", struct.pack(">IIII", 0, 0, timescale, duration) + b"\0" * 4),
+               full_box(b"hdlr", b"\0" * 4 + handler + b"\0" * 12),
+               box(b"minf", stbl)), extra)
+
+
+def make_mp4(faststart=True, audio=True):
+    """10 seconds of 30fps 640x360 video, with 44.1KHz audio"""
+    tracks = [trak(1, b"vide", b"avc1", 15360, 153600, struct.pack(">III", 1, 300, 512), 640, 360)]
+    if audio:
+        tracks.append(trak(2, b"soun", b"mp4a", 44100, 441000, struct.pack(">III", 1, 431, 1024)))
+    moov = box(b"moov", full_box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 10000) + b"\0" * 80), *tracks)
+    ftyp = box(b"ftyp", b"isom\0\0\2\0isomavc1")
+    mdat = box(b"mdat", b"\0" * 4096)
+    return ftyp + (moov + mdat if faststart else mdat + moov)
+
+
+def make_fragmented_mp4():
+    """Like Reddit's DASH videos, 2 fragments of 60 frames at 30fps"""
+    moov = box(b"moov", full_box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 0) + b"\0" * 80),
+               trak(1, b"vide", b"avc1", 15360, 0, struct.pack(">I", 0), 1280, 720),
+               box(b"mvex", full_box(b"trex", struct.pack(">IIIII", 1, 1, 512, 0, 0))))
+    fragments = b""
+    for i in range(2):
+        traf = box(b"traf", full_box(b"tfhd", struct.pack(">I", 1)),
+                   full_box(b"trun", struct.pack(">I", 60)))
+        fragments += box(b"moof", traf) + box(b"mdat", b"\0" * 1024)
+    return box(b"ftyp", b"iso5\0\0\2\0iso5dash") + moov + fragments
+
+
+def ebml(element_id, payload):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + bytes([0x08]) + len(payload).to_bytes(4, "big") + payload
+
+
+def make_webm():
+    """5.5 seconds of 24fps 320x240 VP9 with Opus audio"""
+    info = ebml(0x1549A966, ebml(0x2AD7B1, (1000000).to_bytes(3, "big")) + ebml(0x4489, struct.pack(">d", 5500)))
+    video = ebml(0xAE, ebml(0xD7, b"\1") + ebml(0x83, b"\1") + ebml(0x86, b"V_VP9") +
+                 ebml(0x23E383, (41666667).to_bytes(4, "big")) +
+                 ebml(0xE0, ebml(0xB0, (320).to_bytes(2, "big")) + ebml(0xBA, (240).to_bytes(2, "big"))))
+    audio = ebml(0xAE, ebml(0xD7, b"\2") + ebml(0x83, b"\2") + ebml(0x86, b"A_OPUS"))
+    segment = ebml(0x18538067, info + ebml(0x1654AE6B, video + audio) + ebml(0x1F43B675, b"\0" * 512))
+    return ebml(0x1A45DFA3, ebml(0x4282, b"webm")) + segment
+
+
+class ContainerInfoTests(unittest.TestCase):
+    def test_mp4(self):
+        info = read_container(BytesIO(make_mp4()))
+        self.assertEqual(info.format, MP4)
+        self.assertEqual(info.duration, 10)
+        self.assertEqual(info.dimensions, (640, 360))
+        self.assertEqual(info.frame_count, 300)
+        self.assertEqual(info.fps, 30)
+        self.assertEqual(info.video.codec, "h264")
+        self.assertEqual(info.audio.codec, "aac")
+        self.assertTrue(info.moov_at_start)
+
+    def test_mp4_moov_at_end(self):
+        info = read_container(BytesIO(make_mp4(faststart=False, audio=False)))
+        self.assertFalse(info.moov_at_start)
+        self.assertIsNone(info.audio)
+
+    def test_fragmented_mp4(self):
+        info = read_container(BytesIO(make_fragmented_mp4()))
+        self.assertTrue(info.fragmented)
+        self.assertEqual(info.frame_count, 120)
+        self.assertEqual(info.duration, 4)
+        self.assertEqual(info.fps, 30)
+
+    def test_webm(self):
+        info = read_container(BytesIO(make_webm()))
+        self.assertEqual(info.format, WEBM)
+        self.assertEqual(info.duration, 5.5)
+        self.assertEqual(info.dimensions, (320, 240))
+        self.assertAlmostEqual(info.fps, 24, 3)
+        self.assertEqual(info.video.codec, "vp9")
+        self.assertEqual(info.audio.codec, "opus")
+
+    def test_not_container(self):
+        self.assertIsNone(container_type(BytesIO(b"GIF89a")))
+        with self.assertRaises(ContainerParseError):
+            read_container(BytesIO(b"GIF89a" + b"\0" * 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
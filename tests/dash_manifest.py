@@ -0,0 +1,65 @@
+import unittest
+from vredditshare.utils.dash_manifest import parse_manifest, parse_duration, ManifestParseError, VIDEO, AUDIO
+
+URL = "https://v.redd.it/abc123/DASHPlaylist.mpd?a=1"
+
+# Trimmed down version of what Reddit serves
+REDDIT_MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT1M2.5S" minBufferTime="PT1.500S"
+     profiles="urn:mpeg:dash:profile:isoff-on-demand:2011" type="static">
+  <Period duration="PT1M2.5S">
+    <AdaptationSet contentType="video" maxHeight="720" maxWidth="1280" segmentAlignment="true">
+      <Representation bandwidth="1205020" codecs="avc1.4d401f" frameRate="30" height="480" id="2" mimeType="video/mp4" width="854">
+        <BaseURL>DASH_480.mp4</BaseURL>
+      </Representation>
+      <Representation bandwidth="2404108" codecs="avc1.4d401f" frameRate="30" height="720" id="3" mimeType="video/mp4" width="1280">
+        <BaseURL>DASH_720.mp4</BaseURL>
+      </Representation>
+      <Representation bandwidth="301254" codecs="avc1.4d401f" frameRate="30" height="240" id="1" mimeType="video/mp4" width="426">
+        <BaseURL>DASH_240.mp4</BaseURL>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="audio" lang="en" segmentAlignment="true">
+      <Representation audioSamplingRate="48000" bandwidth="63998" codecs="mp4a.40.2" id="4" mimeType="audio/mp4">
+        <BaseURL>DASH_AUDIO_64.mp4</BaseURL>
+      </Representation>
+      <Representation audioSamplingRate="48000" bandwidth="128004" codecs="mp4a.40.2" id="5" mimeType="audio/mp4">
+        <BaseURL>DASH_AUDIO_128.mp4</BaseURL>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>"""
+
+
+class TestDashManifest(unittest.TestCase):
+    def test_reddit_manifest(self):
+        manifest = parse_manifest(REDDIT_MANIFEST, URL)
+        self.assertEqual(manifest.duration, 62.5)
+        self.assertEqual([r.height for r in manifest.videos], [720, 480, 240])
+        self.assertEqual(manifest.videos[0].url, "https://v.redd.it/abc123/DASH_720.mp4")
+        self.assertEqual(manifest.videos[0].kind, VIDEO)
+        self.assertEqual(manifest.audio.url, "https://v.redd.it/abc123/DASH_AUDIO_128.mp4")
+        self.assertEqual(manifest.audio.kind, AUDIO)
+        self.assertAlmostEqual(manifest.videos[0].estimated_size(manifest.duration), 2404108 * 62.5 / 8)
+
+    def test_no_audio(self):
+        text = REDDIT_MANIFEST[:REDDIT_MANIFEST.index('    <AdaptationSet contentType="audio"')] + "  </Period>\n</MPD>"
+        manifest = parse_manifest(text, URL)
+        self.assertIsNone(manifest.audio)
+        self.assertEqual(len(manifest.videos), 3)
+
+    def test_durations(self):
+        self.assertEqual(parse_duration("PT4.004S"), 4.004)
+        self.assertEqual(parse_duration("PT1H0M30S"), 3630)
+        self.assertIsNone(parse_duration("10 seconds"))
+        self.assertIsNone(parse_duration(None))
+
+    def test_not_a_manifest(self):
+        with self.assertRaises(ManifestParseError):
+            parse_manifest("<html><body>Not found</body></html>", URL)
+        with self.assertRaises(ManifestParseError):
+            parse_manifest("not xml", URL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import struct
+from io import BytesIO
+from vredditshare.utils.gif_info import parse_gif, is_gif, GifParseError
+
+
+def make_gif(frames, delay=4, loop=True, width=10, height=20, controls=None):
+    """Builds a gif out of blocks, the image data is junk since the parser never decodes it. controls are the
+    graphic control flags for each frame"""
+    blocks = [b"GIF89a", struct.pack("<HHBBB", width, height, 0x80, 0, 0), b"\0" * 6]
+    if loop:
+        blocks.append(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+    for i in range(frames):
+        control = controls[i] if controls else 0
+        blocks.append(b"\x21\xf9\x04" + bytes([control]) + struct.pack("<H", delay) + b"\x00\x00")
+        blocks.append(b"\x2c" + struct.pack("<HHHHB", 0, 0, width, height, 0) + b"\x02")
+        blocks.append(b"\xff" + b"a" * 255 + b"\x03abc\x00")
+    blocks.append(b"\x3b")
+    return b"".join(blocks)
+
+
+class GifInfoTests(unittest.TestCase):
+    def test_metadata(self):
+        info = parse_gif(BytesIO(make_gif(50, delay=4)))
+        self.assertEqual(info.dimensions, (10, 20))
+        self.assertEqual(info.frame_count, 50)
+        self.assertEqual(info.duration, 2)
+        self.assertEqual(info.fps, 25)
+        self.assertEqual(info.loop_count, 0)
+        self.assertFalse(info.truncated)
+
+    def test_no_loop(self):
+        info = parse_gif(BytesIO(make_gif(3, loop=False)))
+        self.assertFalse(info.loops)
+
+    def test_short_delays(self):
+        # Delays that are too short get played back at 10/100 of a second
+        info = parse_gif(BytesIO(make_gif(10, delay=1)))
+        self.assertEqual(info.duration, 1)
+
+    def test_truncated(self):
+        info = parse_gif(BytesIO(make_gif(3)[:-10]))
+        self.assertEqual(info.frame_count, 2)
+        self.assertTrue(info.truncated)
+
+    def test_transparency(self):
+        self.assertFalse(parse_gif(BytesIO(make_gif(3))).transparent)
+        # Transparent first frame
+        self.assertTrue(parse_gif(BytesIO(make_gif(3, controls=[0x01, 0, 0]))).transparent)
+        # Later frames drawn over the last one with transparency are still opaque
+        self.assertFalse(parse_gif(BytesIO(make_gif(3, controls=[0x04, 0x05, 0x05]))).transparent)
+        # Unless the last one was cleared first
+        self.assertTrue(parse_gif(BytesIO(make_gif(3, controls=[0x08, 0x05, 0x05]))).transparent)
+
+    def test_not_gif(self):
+        self.assertFalse(is_gif(BytesIO(b"\x00\x00\x00\x18ftypmp42")))
+        with self.assertRaises(GifParseError):
+            parse_gif(BytesIO(b"\x00\x00\x00\x18ftypmp42"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from vredditshare.core import constants as consts
+from vredditshare.core.transcode import plan, could_fit, MIN_VIDEO_BITRATE, AUDIO_BITRATE
+from vredditshare.hosts import FileEstimate
+
+
+class Host:
+    name = "Test"
+    vid_size_limit = 200
+    vid_len_limit = 0
+    can_vid = True
+
+
+class ShortHost(Host):
+    name = "Short"
+    vid_len_limit = 60
+
+
+class UnlimitedHost(Host):
+    name = "Unlimited"
+    vid_size_limit = 0
+
+
+class TestPlan(unittest.TestCase):
+    def test_fits_limit(self):
+        p = plan(Host, 120, audio=True, height=1080)
+        total = (p.video_bitrate + p.audio_bitrate) * 120 / 8000
+        self.assertLessEqual(total, Host.vid_size_limit)
+        self.assertGreater(total, Host.vid_size_limit * 0.9)
+        self.assertEqual(p.audio_bitrate, AUDIO_BITRATE)
+
+    def test_lower_bitrate_lowers_resolution(self):
+        short = plan(Host, 60, height=2160)
+        long = plan(Host, 600, height=2160)
+        self.assertGreater(short.height, long.height)
+
+    def test_never_upscales(self):
+        self.assertIsNone(plan(Host, 60, height=360).height)
+
+    def test_too_long(self):
+        duration = Host.vid_size_limit * 8000 / (MIN_VIDEO_BITRATE - 1)
+        self.assertIsNone(plan(Host, duration))
+        self.assertIsNone(plan(Host, 0))
+
+
+class Gif:
+    nsfw = False
+
+
+class HostManager:
+    """Stands in for GifHostManager with a fixed set of hosts, only checking the length limit"""
+    def __init__(self, *hosts):
+        self.hosts = hosts
+
+    def get_upload_host(self, gif, file=None):
+        hosts = [host for host in self.hosts if host.can_vid and (host.vid_len_limit == 0 or file.duration is None
+                                                                  or host.vid_len_limit >= file.duration)]
+        return [{"file": file, "hosts": hosts}] if hosts else []
+
+
+class TestCouldFit(unittest.TestCase):
+    def test_too_big(self):
+        ghm = HostManager(Host)
+        self.assertTrue(could_fit(ghm, Gif, FileEstimate(consts.MP4, 1000, 50)))
+        # Nothing to go off for duration, let it through
+        self.assertTrue(could_fit(ghm, Gif, FileEstimate(consts.MP4, 1000, None)))
+
+    def test_too_long(self):
+        self.assertFalse(could_fit(HostManager(Host), Gif, FileEstimate(consts.MP4, 1000, 100000)))
+        self.assertFalse(could_fit(HostManager(ShortHost), Gif, FileEstimate(consts.MP4, 1000, 120)))
+
+    def test_no_size_limit(self):
+        # A host without a size limit would have taken it already, there's nothing to aim for
+        self.assertFalse(could_fit(HostManager(UnlimitedHost), Gif, FileEstimate(consts.MP4, 1000, 50)))
+
+    def test_gif(self):
+        self.assertFalse(could_fit(HostManager(Host), Gif, FileEstimate(consts.GIF, 1000, 50)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 import praw
 import prawcore
+import requests
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 from datetime import datetime, timedelta
 from vredditshare.core.process import process_comment, process_mod_invite
 from vredditshare.core.credentials import CredentialsLoader
@@ -11,6 +14,10 @@ from vredditshare.core.constants import SUCCESS, USER_FAILURE, UPLOAD_FAILURE
 from vredditshare.core.secret import secret_process
 from vredditshare.core.arguments import parser
 from vredditshare.core.operator import Operator
+from vredditshare.core.poll import PollScheduler
+from vredditshare.core.retry import is_due, record_failure, clear_retry
+from vredditshare.utils.temp_folder import ScratchSpace, ScratchQuotaExceeded
+from vredditshare.utils.downloader import DownloadMetrics
 from pony.orm.dbapiprovider import OperationalError
 
 credentials = CredentialsLoader().get_credentials()
@@ -18,12 +25,22 @@ credentials = CredentialsLoader().get_credentials()
 is_production = credentials['general'].get('mode', "production").lower() == "production"
 step_requests = credentials['general'].get('step_requests', "false").lower() == "true"
 operator = credentials['general']['operator']
+# Number of requests that can be processed at the same time
+workers = max(int(credentials['general'].get('workers', 1)), 1)
 
-reddit = praw.Reddit(user_agent=consts.user_agent,
-                     client_id=credentials['reddit']['client_id'],
-                     client_secret=credentials['reddit']['client_secret'],
-                     username=credentials['reddit']['username'],
-                     password=credentials['reddit']['password'])
+
+
+def make_reddit():
+    return praw.Reddit(user_agent=consts.user_agent,
+                       client_id=credentials['reddit']['client_id'],
+                       client_secret=credentials['reddit']['client_secret'],
+                       username=credentials['reddit']['username'],
+                       password=credentials['reddit']['password'])
+
+
+reddit = make_reddit()
+# PRAW isn't thread safe, so each worker thread gets its own Reddit instance
+_worker_local = threading.local()
 
 args = parser.parse_args()
 
@@ -36,22 +53,122 @@ if args.cutoff:
     cutoff = int(args.cutoff)
 
 
+def worker_reddit() -> praw.Reddit:
+    """The Reddit instance for the current worker thread, made the first time the thread asks for it"""
+    worker = getattr(_worker_local, "reddit", None)
+    if worker is None:
+        worker = make_reddit()
+        _worker_local.reddit = worker
+        Operator.set_thread_user(worker.redditor(operator))
+    return worker
+
+
+def handle_comment(message):
+    """Process a summon from the inbox, this runs on one of the worker threads"""
+    result = None
+    reddit = worker_reddit()
+    try:
+        # username mentions are simple
+        if message.subject == "username mention":
+            result = process_comment(reddit, reddit.comment(message.id))
+        # if it was a reply, check to see if it contained a summon
+        elif message.subject == "comment reply" or message.subject == "post reply":
+            if REPatterns.reply_mention.findall(message.body):
+                result = process_comment(reddit, reddit.comment(message.id))
+            else:
+                secret_process(reddit, message)
+                result = SUCCESS
+    except ScratchQuotaExceeded as e:
+        # Too much else going on, leave it for a retry once other requests have cleaned up
+        print(e)
+        result = UPLOAD_FAILURE
+    except requests.RequestException as e:
+        # A host timed out or dropped the connection after the retries gave up, try the request again later
+        print("Request to a host failed", e)
+        result = UPLOAD_FAILURE
+    finally:
+        new_operator.unset_request_info()
+    return result
+
+
+def collect_results(pending, return_when=FIRST_COMPLETED):
+    """Wait on running requests and mark finished ones read. Returns how many of the uploads failed"""
+    failures = 0
+    done, _ = wait(pending, return_when=return_when)
+    for future in done:
+        message = pending.pop(future)
+        # Exceptions from the worker are raised here so the main loop can handle them
+        result = future.result()
+        # Depending on success or other outcomes, we mark the message read
+        if result == SUCCESS or result == USER_FAILURE:
+            mark_read.append(message)
+            clear_retry(message.id)
+        # If the upload failed, try again later
+        elif result == UPLOAD_FAILURE:
+            failures += 1
+            if record_failure(message.id, "Upload failed"):
+                mark_read.append(message)
+                new_operator.message(f"Gave up on https://reddit.com{message.context} after "
+                                     f"{consts.max_retries} failed attempts", "Gave up")
+            else:
+                print("Upload failed, not removing from queue")
+        if len(mark_read) >= 5:     # Mark read every 5 in a batch to avoid a small chance of disaster
+            reddit.inbox.mark_read(mark_read)
+            mark_read.clear()
+    return failures
+
+
+def stop_workers(executor, pending):
+    """Cancel requests that haven't started and wait for the running ones to finish. The ones that finish have
+    already replied, so they're collected to be marked read rather than being picked up again on restart"""
+    for future in list(pending):
+        if future.cancel():
+            pending.pop(future)
+    executor.shutdown()
+    while pending:
+        # One request raising shouldn't stop the rest from being marked read
+        try:
+            collect_results(pending, ALL_COMPLETED)
+        except Exception:
+            traceback.print_exc()
+
+
+def print_download_stats():
+    downloads = DownloadMetrics.summary()
+    if downloads['downloads']:
+        print(f"Last {downloads['downloads']} downloads: {round(downloads['bytes'] / 1000000, 1)}MB at "
+              f"{round(downloads['throughput'] / 1000000, 2)}MB/s, {downloads['segmented']} segmented")
+
+
 def main():
     db_connected = True
     failure_counter = 1  # 1 by default since it is the wait timer multiplier
+    testing = credentials['general'].get('testing', "false").lower() == "true"
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="request")
+    pending = {}
+    scheduler = PollScheduler()
     print(f"{consts.bot_name} v{consts.version} Ctrl+C to stop")
+    orphans = ScratchSpace.clean_orphans()
+    scratch = ScratchSpace.report()
+    print(f"Scratch space at {scratch['location']} ({scratch['disk_location']} for big files), removed {orphans} "
+          f"leftover folders, {scratch['usage'] / 1000000}MB used of {scratch['quota'] / 1000000}MB")
 
     while True:
         try:
-            failure = False
+            failures = 0
+            waiting = 0
+            messages = 0
+            scheduler.start_pass()
+            if pending:     # Requests left running after an exception
+                failures += collect_results(pending, ALL_COMPLETED)
             if mark_read:   # Needed to clear after a Reddit disconnection error
                 reddit.inbox.mark_read(mark_read)
                 mark_read.clear()
             # for all unread messages
             for message in reddit.inbox.unread():
+                messages += 1
                 # for all unread comments
                 if message.was_comment:
-                    result = None
                     # Comments that arrive the same time the inbox is being checked may not have an ID?
                     if not message.id:
                         new_operator.message("Message had no ID???")
@@ -60,24 +177,14 @@ def main():
                             print("Skipping older message")
                             mark_read.append(message)
                             continue    # Skips the 5 message mark read step but probably fine
-                    # username mentions are simple
-                    if message.subject == "username mention":
-                        result = process_comment(reddit, reddit.comment(message.id))
-                    # if it was a reply, check to see if it contained a summon
-                    elif message.subject == "comment reply" or message.subject == "post reply":
-                        if REPatterns.reply_mention.findall(message.body):
-                            result = process_comment(reddit, reddit.comment(message.id))
-                        else:
-                            secret_process(reddit, message)
-                            result = SUCCESS
-                    new_operator.unset_request_info()
-                    # Depending on success or other outcomes, we mark the message read
-                    if result == SUCCESS or result == USER_FAILURE:
-                        mark_read.append(message)
-                    # If the upload failed, try again later
-                    elif result == UPLOAD_FAILURE:
-                        failure = True
-                        print("Upload failed, not removing from queue")
+                    # Failed requests wait a while before they are tried again
+                    if not is_due(message.id):
+                        waiting += 1
+                        continue
+                    pending[executor.submit(handle_comment, message)] = message
+                    # Don't pull more from the inbox than the workers can keep up with
+                    if len(pending) >= workers * 2:
+                        failures += collect_results(pending)
                 else:  # was a message
                     if message.subject[:22] == 'invitation to moderate':
                         subreddit = process_mod_invite(reddit, message)
@@ -94,21 +201,29 @@ def main():
                 if not db_connected:
                     db_connected = True
                     new_operator.message("The bot was able to reconnect to the database.", "DB Reconnected")
-                if credentials['general'].get('testing', "false").lower() == "true":
+                if testing:
+                    # Step through requests one at a time
+                    if pending:
+                        failures += collect_results(pending, ALL_COMPLETED)
                     print("Press enter to continue or type something to quit")
                     if len(input()):
                         print("You can now safely end the process")
-                        break
+                        executor.shutdown()
+                        return
+            if pending:
+                failures += collect_results(pending, ALL_COMPLETED)
             if mark_read:
                 reddit.inbox.mark_read(mark_read)
                 mark_read.clear()
-            if failure:
+            if messages:
+                print_download_stats()
+            if failures:
                 print("An upload failed, extending wait")
                 # failure_counter += 1
             else:
                 failure_counter = 1
 
-            time.sleep(consts.sleep_time * failure_counter)
+            time.sleep(scheduler.end_pass(messages, failures + waiting) * failure_counter)
 
         except prawcore.exceptions.ResponseException as e:   # Something funky happened
             print("Did a comment go missing?", e, vars(e))
@@ -119,8 +234,10 @@ def main():
             time.sleep(consts.sleep_time * 2)
 
         except KeyboardInterrupt:
+            print("Exiting...", scheduler.summary())
+            print_download_stats()
+            stop_workers(executor, pending)
             reddit.inbox.mark_read(mark_read)
-            print("Exiting...")
             break
 
         except OperationalError:
@@ -136,6 +253,7 @@ def main():
         #     time.sleep(consts.sleep_time * 2)
 
         except Exception as e:
+            stop_workers(executor, pending)
             reddit.inbox.mark_read(mark_read)
             new_operator.message("Help I crashed!\n\n    {}".format(str(traceback.format_exc()).replace('\n', '\n    ')),
                                  "Error!", False)
@@ -2,9 +2,11 @@ import subprocess
 import os
 import json
 import platform
+import time
 from io import BytesIO
-from random import randint
 from vredditshare.utils.temp_folder import TempFolder
+from vredditshare.utils.media_buffer import MediaBuffer
+from vredditshare.utils.process_file import process_path
 
 if platform.system() == 'Windows':
     ffmpeg = 'ffmpeg.exe'
@@ -18,36 +20,39 @@ else:
 
 def concat(video, audio):
     """
-    Combines video and audio
+    Combines video and audio. ffmpeg reads both straight from where they already are and writes the result straight
+    into the returned buffer, nothing gets copied along the way
     :param video: video stream
     :param audio: audio stream
-    :return:
+    :return: MediaBuffer of the mp4, None if ffmpeg failed
     """
 
     print("Combining video and audio...")
-
-    with TempFolder(f"grbconcat-{randint(0, 1000)}") as temp_folder:
-        with open(temp_folder / "video.mp4", "wb") as f:
-            f.write(video.read())
-
-        with open(temp_folder / "audio.mp4", "wb") as f:
-            f.write(audio.read())
-
-        out_file = temp_folder / "temp.mp4"
-        subprocess.Popen(
-            [ffmpeg, "-loglevel", "panic", "-i", temp_folder / "video.mp4", "-i", temp_folder / "audio.mp4",
-             "-c:v", "copy", "-c:a", "copy", "-y", out_file]
-        ).communicate()
-
-        with open(out_file, "rb") as f:
-            file = BytesIO(f.read())
+    start = time.time()
+
+    file = MediaBuffer(prefix="concat")
+    with process_path(video, "video.mp4") as video_path, process_path(audio, "audio.mp4") as audio_path:
+        p = subprocess.Popen(
+            [ffmpeg, "-loglevel", "error", "-i", video_path, "-i", audio_path,
+             "-c:v", "copy", "-c:a", "copy", "-f", "mp4", "-y", file.target()],
+            stderr=subprocess.PIPE
+        )
+        error = p.communicate()[1]
+    file.seek(0)
+
+    if p.returncode != 0 or len(file) == 0:
+        print("Couldn't combine video and audio", error.decode(errors="replace"))
+        file.close()
+        return None
+    print(f"Combined video and audio in {round(time.time() - start, 2)}s")
     return file
 
 
 def vid_to_gif(image, path=False):
     """
     :param image: filestream to reverse
-    :param path: if you just want the string path to the file instead of the filestream
+    :param path: if you just want the string path to the file instead of the filestream. The file is left in its
+    own scratch folder which the caller has to delete
     :return: filestream of a gif
     """
     if platform.system() == 'Windows':
@@ -60,10 +65,11 @@ def vid_to_gif(image, path=False):
         gifski = 'gifski'
 
     print("Reversing gif...")
-    with TempFolder(f"grb-vidgif-{randint(0, 1000)}") as temp_folder:
-
-        with open(temp_folder / "in.mp4", "wb") as f:
-            f.write(image.read())
+    # If the caller wants a path, the folder has to outlive this function so it's up to them to clean it up
+    temp = TempFolder("vidgif")
+    temp_folder = temp.folder
+    try:
+        temp.write("in.mp4", image)
 
         # Get correct fps
         command = subprocess.Popen(
@@ -78,40 +84,35 @@ def vid_to_gif(image, path=False):
         print("Exporting frames...")
 
         subprocess.Popen(
-            [ffmpeg, "-loglevel", "panic", "-i", "in.mp4", "frame%04d.png"]
+            [ffmpeg, "-loglevel", "panic", "-i", temp_folder / "in.mp4", temp_folder / "frame%04d.png"]
         ).communicate()
 
         os.remove(temp_folder / "in.mp4")
 
-        # Statistics
-        for i in os.walk(temp_folder):
-            files = i[2]
-            break
-        pics_size = sum(os.path.getsize(temp_folder / f) for f in files)
+        frames = sorted(str(f) for f in temp_folder.glob("frame*.png"))
+        pics_size = sum(os.path.getsize(f) for f in frames)
         print(pics_size)
 
         print("Rebuilding gif...")
 
-        if platform.system() == 'Windows':
-            p = subprocess.Popen(
-                ['{}'.format(gifski), "-o", "../temp.gif", "--fps", str(round(fps)), temp_folder / "frame*.png"],
-                shell=True
-            )
-        else:
-            p = subprocess.Popen(
-                [f"{gifski} -o ../temp.gif --fps {str(round(fps))} {temp_folder / 'frame*.png'}"],
-                shell=True
-            )
+        out_file = temp_folder / "out.gif"
+        subprocess.Popen(
+            [gifski, "-o", out_file, "--fps", str(round(fps))] + frames
+        ).communicate()
 
-        p.communicate()
+        for f in frames:
+            os.remove(f)
 
-    print("done")
+        print("done")
 
-    # More statistics
-    gif_size = os.path.getsize("temp.gif")
-    print("pngs size, gif size, ratio", pics_size / 1000000, gif_size / 1000000, gif_size / pics_size)
+        # More statistics
+        gif_size = os.path.getsize(out_file)
+        print("pngs size, gif size, ratio", pics_size / 1000000, gif_size / 1000000, gif_size / pics_size)
 
-    if path:
-        return "temp.gif"
-    else:
-        return open("temp.gif", "rb")
+        if path:
+            return str(out_file)
+        with open(out_file, "rb") as f:
+            return BytesIO(f.read())
+    finally:
+        if not path:
+            temp.close()
@@ -7,7 +7,13 @@ version = importlib.metadata.version(__package__.split(".")[0])
 user_agent = f"{bot_name} v{version} by /u/pmdevita"
 spoof_user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:62.0) Gecko/20100101 Firefox/62.0"
 
-sleep_time = 90
+sleep_time = 90     # Longest wait between inbox checks
+min_sleep_time = 5  # Shortest wait between inbox checks, used while the inbox is busy
+
+max_retries = 8             # Attempts at a failed upload before giving up on the request
+retry_base_delay = 90       # Wait before the first retry in secs, doubles with every failure
+retry_max_delay = 6 * 3600  # Longest wait between retries in secs
+
 username = CredentialsLoader.get_credentials()['reddit']['username']
 
 issue_link = f"https://www.reddit.com/message/compose/?to=pmdevita&subject={bot_name}%20Issue&message=" \
@@ -3,12 +3,12 @@ from praw.const import API_PATH
 from vredditshare.core import constants as consts
 from vredditshare.core.regex import REPatterns
 from vredditshare.core.gif import GifHostManager
+from vredditshare.core.moderation import ModeratedSubreddits
+from vredditshare.core.reddit_cache import add_submission, is_subreddit_nsfw
 from vredditshare.hosts import GifHost
 from vredditshare.hosts.reddit import RedditVid
 from pprint import pprint
 
-# TODO: Minimize API calls through refresh() https://praw.readthedocs.io/en/latest/code_overview/models/comment.html
-
 
 class CommentContext:
     def __init__(self, reddit, comment, ghm):
@@ -17,10 +17,12 @@ class CommentContext:
         self.comment = comment
         self.rereverse = False
         self.unnecessary_manual = False
-        self.nsfw = is_nsfw(comment)
+        # Fetch the whole comment chain up front so we aren't making a request for each parent
+        chain = get_comment_chain(reddit, comment)
+        self.nsfw = is_nsfw(chain[-1])
         self.distinguish = False
         # self.reupload = is_reupload(comment.body)
-        self.url = self.determine_target_url(reddit, self.comment)
+        self.url = self.determine_target_url(reddit, chain)
 
     @classmethod
     def from_json(cls, reddit, data):
@@ -47,13 +49,11 @@ class CommentContext:
         data['url'] = str(self.url)
         return data
 
-    def determine_target_url(self, reddit, reddit_object, layer=0, checking_manual=False):
-        """Recursively find the gif URL the user wants"""
-        # If the object is a post, check it's URL
-        if isinstance(reddit_object, praw.models.Submission):
-            # Running through enough levels can cause a recursion error,
-            # which we need to then refresh our comment
-            try:
+    def determine_target_url(self, reddit, chain, checking_manual=False):
+        """Find the gif URL the user wants by going up the comment chain"""
+        for layer, reddit_object in enumerate(chain):
+            # The post is the top of the chain, either it has the URL or there is none
+            if isinstance(reddit_object, praw.models.Submission):
                 # Any mention of NSFW must trip the NSFW flag
                 if is_nsfw_text(reddit_object.title) and not checking_manual:
                     self.nsfw = True
@@ -64,23 +64,14 @@ class CommentContext:
                         self.nsfw = True
                     # Search text for URL
                     url = self.ghm.host_names['RedditVideo'].get_gif(text=reddit_object.selftext, nsfw=self.nsfw)
-                    # If found
-                    if isinstance(url, RedditVid):
-                        # Return it
-                        return url
                 # Else if the post is a link post, check it's URL
                 else:
                     url = self.ghm.host_names['RedditVideo'].get_gif(text=reddit_object.url, nsfw=self.nsfw)
-                    if isinstance(url, RedditVid):
-                        return url
-                    else:
-                        return None
-            except RecursionError:
-                submission = reddit.submission(id=reddit_object.id)
-                return self.determine_target_url(reddit, submission, layer + 1, checking_manual)
+                if isinstance(url, RedditVid):
+                    return url
+                return None
 
-        # Else if the object is a comment, check it's text
-        elif isinstance(reddit_object, praw.models.Comment):
+            # Else the object is a comment, check it's text
             # Any mention of NSFW must trip the NSFW flag
             if is_nsfw_text(reddit_object.body) and not checking_manual:
                 self.nsfw = True
@@ -89,21 +80,20 @@ class CommentContext:
             # if reddit_object.author == consts.username and not self.rereverse and not checking_manual \
             #         and not self.reupload:
             #     self.rereverse = True
-            #     return self.determine_target_url(reddit, reddit_object.parent(), layer+1, checking_manual)
+            #     continue
             # If it's an AutoModerator summon, move our summon comment to the AutoMod's parent
             if reddit_object.author == "AutoModerator":
-                # IF this is layer 0, this is an Automoderator summon. Check if we are doing a comment replacement
-                if layer == 0:
+                # IF this is the summon comment, this is an Automoderator summon. Check if we are doing a comment
+                # replacement
+                if layer == 0 and not checking_manual:
                     # Delete comment if a moderator
-                    modded_subs = [i.name for i in reddit.user.me().moderated()]
-                    if reddit_object.subreddit.name in modded_subs:
-                        self.comment = reddit_object.parent()
+                    if reddit_object.subreddit.name in ModeratedSubreddits.get(reddit):
+                        self.comment = chain[1]
                         if reddit_object.stickied:
                             self.distinguish = True
                         reddit_object.mod.remove()
-                        reddit_object = self.comment
                         # Skip to the next object in the hierarchy
-                        return self.determine_target_url(reddit, reddit_object, layer+1, checking_manual)
+                        continue
                 # If we are rereversing and we encounter an AutoModerator comment that summoned us, immediately stop.
                 # It's likely a AutoModerator summon loop
                 elif self.rereverse:
@@ -117,31 +107,67 @@ class CommentContext:
             # If found
             if isinstance(url, RedditVid):
                 # Return it
-                if layer == 0:  # If this is the summon comment
-                    # Double check they didn't needlessly give us the URL again
-                    next_url = self.determine_target_url(reddit, reddit_object.parent(), layer+1, True)
+                if layer == 0 and not checking_manual:  # If this is the summon comment
+                    # Double check they didn't needlessly give us the URL again. This carries on up the chain we
+                    # already have in memory
+                    next_url = self.determine_target_url(reddit, chain[1:], True)
                     if url == next_url:
                         self.unnecessary_manual = True
                 return url
             # We didn't find a gif, go up a level
-            return self.determine_target_url(reddit, reddit_object.parent(), layer+1, checking_manual)
+        return None
+
+
+def get_comment_chain(reddit, comment):
+    """Get a comment, all of its parents and its submission, ordered from the comment up to the submission.
+    Reddit gives us the submission and several levels of parents when asked for a comment with context, so most
+    chains only need one request instead of one for each parent."""
+    if isinstance(comment, praw.models.Submission):
+        return [comment]
+    path = API_PATH['submission'].format(id=comment.submission.id) + f"_/{comment.id}"
+    submission_listing, comment_listing = reddit.get(path, params={"context": 100})
+    submission = submission_listing.children[0]
+    chain = _find_comment_path(comment_listing.children, comment.id)
+    if chain:
+        chain.reverse()
+        chain[0] = comment
+    else:
+        chain = [comment]
+    # The context is limited, get any parents that are left one at a time
+    while not chain[-1].parent_id.startswith("t3_"):
+        chain.append(chain[-1].parent())
+    chain.append(submission)
+    return chain
+
+
+def _find_comment_path(comments, comment_id):
+    """Depth first search for a comment in a tree, returns the comments from the top level down to it"""
+    for comment in comments:
+        if not isinstance(comment, praw.models.Comment):
+            continue
+        if comment.id == comment_id:
+            return [comment]
+        path = _find_comment_path(comment.replies, comment_id)
+        if path:
+            return [comment] + path
+    return None
 
 
 # Works but will mark a sfw gif first posted in an nsfw sub as nsfw ¯\_(ツ)_/¯
 def is_nsfw(comment):
     # Identify if submission is nsfw
     if isinstance(comment, praw.models.Comment):
-        post_nsfw = comment.submission.over_18
-        # Why no underscore
-        sub_nsfw = comment.subreddit.over18
-        # print("nsfw", post_nsfw, sub_nsfw)
-        return post_nsfw or sub_nsfw
+        submission = comment.submission
     elif isinstance(comment, praw.models.Submission):
-        post_nsfw = comment.over_18
-        # Why no underscore
-        sub_nsfw = comment.subreddit.over18
-        # print("nsfw", post_nsfw, sub_nsfw)
-        return post_nsfw or sub_nsfw
+        submission = comment
+    else:
+        return None
+    # Goes through the shared cache so the hosts don't have to fetch these again
+    info = add_submission(submission)
+    post_nsfw = info.over_18
+    sub_nsfw = is_subreddit_nsfw(submission.subreddit)
+    # print("nsfw", post_nsfw, sub_nsfw)
+    return post_nsfw or sub_nsfw
 
 
 def is_nsfw_text(text):
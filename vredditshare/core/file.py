@@ -1,64 +1,80 @@
 import json
 import subprocess
-import os
 from io import BytesIO
 from vredditshare.core.operator import Operator
+from vredditshare.core.probe_cache import probe_cache, content_hash
+from vredditshare.utils.gif_info import GifInfo, GifParseError, is_gif, parse_gif
+from vredditshare.utils.container_info import ContainerInfo, ContainerParseError, container_type, read_container, MP4
+from vredditshare.utils.process_file import process_path
 
 # These functions need to be combined for optimization and cleanliness
 # They are doing a lot of the sames stuff already so it's turned into a mess
 
-FILESTREAM_TYPE = "FILESTREAM_TYPE"
-PATH_TYPE = "PATH_TYPE"
-
 
 class MediaInfo:
-    def __init__(self, filestream):
-        if isinstance(filestream, str):
-            file_type = PATH_TYPE
-        else:
-            file_type = FILESTREAM_TYPE
-            filestream.seek(0)
+    """Everything we need to know about a piece of media from a single probe. GIFs, MP4s and WebMs are read
+    directly, anything else (or anything those readers choke on) goes through ffprobe. Build this once per file and
+    pass it around rather than probing the same bytes again.
 
-        self.temp_download = False
-        self.data = self.get_data(filestream, file_type)
+    The probe only reads the container and stream headers. Counting frames means decoding the whole file, so that is
+    only done if frame_count is asked for and the headers didn't have it."""
+    # What gets kept in the probe cache
+    CACHED_FIELDS = ("video", "audio", "format", "dimensions", "duration", "fps", "_frame_count", "_counted")
 
-        # If we didn't get any data back, we probably need to push it to the file system
-        if len(self.data.keys()) == 0:
-            self.temp_download = True
+    def __init__(self, filestream):
+        self._source = filestream
+        self._counted = False
+        # Media we have seen before doesn't need to be probed again
+        self._cache_key = content_hash(filestream)
+        fields = probe_cache.get(self._cache_key)
+        if fields:
+            for field in self.CACHED_FIELDS:
+                setattr(self, field, fields[field])
+            if self.dimensions:
+                self.dimensions = tuple(self.dimensions)
+            self.data = {"streams": [i for i in (self.video, self.audio) if i], "format": self.format}
+        else:
+            self._probe(filestream)
+            self._update_cache()
+
+    def _update_cache(self):
+        probe_cache.set(self._cache_key, {field: getattr(self, field) for field in self.CACHED_FIELDS})
+
+    def _probe(self, filestream):
+        # GIFs can be read without ffprobe, which would otherwise need to decode every frame to count them
+        if is_gif(filestream):
+            try:
+                self._read_gif(parse_gif(filestream))
+                return
+            except GifParseError as e:
+                print("Couldn't read gif, falling back to FFprobe", e)
+        # Same for MP4s and WebMs, where everything we need is in the headers
+        elif container_type(filestream):
+            try:
+                if self._read_container(read_container(filestream)):
+                    return
+            except ContainerParseError as e:
+                print("Couldn't read container, falling back to FFprobe", e)
+
+        self.data = self.get_data(filestream)
+        self.video = self.get_video_stream(self.data.get('streams', []))
+        self.audio = self.get_audio_stream(self.data.get('streams', []))
+
+        self.format = self.data.get('format', {})
+        self.dimensions = None
+        self._frame_count = None
+        self.fps = None
+        # Duration
+        if self.format.get('duration', False):
+            self.duration = float(self.format['duration'])
         else:
-            self.video = self.get_video_stream(self.data['streams'])
-            self.audio = self.get_audio_stream(self.data['streams'])
-            # If it's a gif, we need to save it to the drive first to get all of its data
-            if self.video['codec_name'] == 'gif' and file_type == FILESTREAM_TYPE:
-                self.temp_download = True
-
-        if self.temp_download:
-            self.temp_download = "mediainfo.gif"
-            with open(self.temp_download, 'wb') as f:
-                filestream.seek(0)
-                f.write(filestream.read())
-            file_type = PATH_TYPE
-            filestream = self.temp_download
-            self.data = self.get_data(self.temp_download, PATH_TYPE)
-            self.video = self.get_video_stream(self.data['streams'])
-            self.audio = self.get_audio_stream(self.data['streams'])
-
-        self.format = self.data['format']
+            self.duration = None
         if self.video:
             # Width and Height
             self.dimensions = (self.video['width'], self.video['height'])
-            # Frame count
-            if self.video.get('nb_read_frames', False):
-                self.frame_count = int(self.video['nb_read_frames'])
-            elif self.video.get('nb_frames', False):
-                self.frame_count = int(self.video['nb_frames'])
-            else:
-                self.frame_count = None
-            # Duration
-            if self.format.get('duration', False):
-                self.duration = float(self.format['duration'])
-            else:
-                self.duration = None
+            # Frame count, if the container tells us
+            if self.video.get('nb_frames', False):
+                self._frame_count = int(self.video['nb_frames'])
             # FPS
             fps = None
             if self.video.get('r_frame_rate', False):
@@ -69,53 +85,109 @@ class MediaInfo:
                     fps = self.video['avg_frame_rate'].split("/")
             elif self.video.get('avg_frame_rate', False):
                 fps = self.video['avg_frame_rate'].split("/")
-            if fps:
-                if fps[1] != "0":
-                    self.fps = int(fps[0]) / int(fps[1])
-                else:
-                    print(self.data, fps)
-                # If we have a frame count, verify that the frame_count / fps = duration within some margin
-                if self.frame_count and self.duration:
-                    expected_duration = self.frame_count / self.fps
+            if fps and fps[1] != "0":
+                self.fps = int(fps[0]) / int(fps[1])
+            elif fps:
+                print(self.data, fps)
+            if self.fps:
+                # If the headers gave a frame count, verify that the frame_count / fps = duration within some margin
+                if self._frame_count and self.duration:
+                    expected_duration = self._frame_count / self.fps
                     MARGIN_OF_ERROR = .15  # Must be within 15% of duration
                     if abs((expected_duration / self.duration) - 1) >= MARGIN_OF_ERROR:
                         # FPS must be incorrect, estimate it from duration and frame count
                         previous_fps = self.fps
-                        self.fps = self.frame_count / self.duration
+                        self.fps = self._frame_count / self.duration
                         Operator.context_message(f"FFProbe said FPS is {previous_fps} but given a duration of "
-                                                 f"{self.duration} and a frame count of {self.frame_count}, this should"
-                                                 f" be closer to {self.fps}.", subject="MediaInfo")
+                                                 f"{self.duration} and a frame count of {self._frame_count}, this "
+                                                 f"should be closer to {self.fps}.", subject="MediaInfo")
             else:
-                # No FPS, estimate it if we have duration and frame count
-                if self.frame_count and self.duration:
+                # No FPS, estimate it if we have duration and frame count. This is rare enough that counting the
+                # frames is fine
+                if self.duration and self.frame_count:
                     self.fps = self.frame_count / self.duration
                     Operator.context_message(f"No FPS was determined for this media, guessed it to be {self.fps}.",
                                              subject="MediaInfo")
                 else:
-                    self.fps = None
                     Operator.context_message("No FPS was determined for this media, didn't have frame "
                                              "count to guess either.",
                                              subject="MediaInfo")
         # If we don't have duration still, guess it
         if not self.duration:
-            if self.frame_count and self.fps:
+            if self.fps and self.frame_count:
                 self.duration = self.frame_count / self.fps
             else:
                 self.duration = 0
-        if self.temp_download:
-            os.remove(self.temp_download)
-
-    def get_data(self, filestream, file_type):
-        p = subprocess.Popen(
-            ["ffprobe", "-i", filestream if file_type == PATH_TYPE else "pipe:0", "-v", "quiet",
-             "-print_format", "json", "-show_format", "-show_streams", "-count_frames"],
-            stdin=subprocess.PIPE if file_type == FILESTREAM_TYPE else None, stdout=subprocess.PIPE)
-        if file_type == FILESTREAM_TYPE:
-            output = p.communicate(input=filestream.read())
-        else:
-            output = p.communicate()
+
+    def _read_gif(self, gif: GifInfo):
+        self.video = {"codec_type": "video", "codec_name": "gif", "width": gif.width, "height": gif.height,
+                      "nb_frames": str(gif.frame_count)}
+        self.audio = None
+        self.format = {"format_name": "gif", "duration": str(gif.duration)}
+        self.data = {"streams": [self.video], "format": self.format}
+        self.dimensions = gif.dimensions
+        self.duration = gif.duration
+        self.fps = gif.fps
+        self._frame_count = gif.frame_count
+        self._counted = True
+
+    def _read_container(self, container: ContainerInfo):
+        """Fill in from the container headers. Returns False if they were missing something we need"""
+        if not container.video or not container.dimensions or not container.duration or not container.fps:
+            return False
+        self.video = {"codec_type": "video", "codec_name": container.video.codec, "width": container.dimensions[0],
+                      "height": container.dimensions[1]}
+        if container.frame_count:
+            self.video["nb_frames"] = str(container.frame_count)
+        self.audio = {"codec_type": "audio", "codec_name": container.audio.codec} if container.audio else None
+        self.format = {"format_name": "mov,mp4,m4a,3gp,3g2,mj2" if container.format == MP4 else "matroska,webm",
+                       "duration": str(container.duration)}
+        if container.format == MP4:
+            self.format["moov_at_start"] = container.moov_at_start
+        self.data = {"streams": [i for i in (self.video, self.audio) if i], "format": self.format}
+        self.dimensions = container.dimensions
+        self.duration = container.duration
+        self.fps = container.fps
+        self._frame_count = container.frame_count
+        return True
+
+    @property
+    def frame_count(self):
+        """Number of frames in the video stream, counted on first use if the headers didn't say"""
+        if self._frame_count is None and not self._counted and self.video:
+            self.count_frames()
+        return self._frame_count
+
+    def count_frames(self):
+        """Decode the video stream to get an exact frame count"""
+        self._counted = True
+        data = self.get_data(self._source, count_frames=True)
+        stream = self.get_video_stream(data.get('streams', []))
+        if stream and stream.get('nb_read_frames', False):
+            self._frame_count = int(stream['nb_read_frames'])
+        self._update_cache()
+        return self._frame_count
+
+    @property
+    def valid(self):
+        """Whether ffprobe found a video stream at all"""
+        return self.video is not None
+
+    @property
+    def has_audio(self):
+        return self.audio is not None
+
+    def get_data(self, filestream, count_frames=False):
+        # ffprobe gets a seekable path rather than a pipe, piped gifs and some mp4s come back with nothing
+        with process_path(filestream) as path:
+            output = subprocess.Popen(
+                ["ffprobe", "-i", path, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams"] +
+                (["-count_frames"] if count_frames else []), stdout=subprocess.PIPE).communicate()
         json_data = output[0].decode("utf-8")
-        data = json.loads(json_data)
+        try:
+            data = json.loads(json_data)
+        except json.decoder.JSONDecodeError:
+            data = {}
         return data
 
     def get_video_stream(self, streams):
@@ -130,106 +202,6 @@ class MediaInfo:
                 return stream
         return None
 
-def get_duration(filestream):
-    filestream.seek(0)
-    p = subprocess.Popen(
-        ["ffprobe", "-i", "pipe:0", "-v", "quiet", "-print_format", "json", "-show_format"],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    output = p.communicate(input=filestream.read())[0].decode("utf-8")
-    data = json.loads(output)
-    if not data.get('format', {}).get('duration', None):
-        # Can happen sometimes if the file isn't on the drive
-        with open('tempfile', 'wb') as f:
-            filestream.seek(0)
-            f.write(filestream.read())
-        p = subprocess.Popen(
-            ["ffprobe", "-i", "tempfile", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams"],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        output = p.communicate()[0].decode("utf-8")
-        data = json.loads(output)
-        os.remove('tempfile')
-    if data['format'].get('duration', None):
-        return float(data['format']['duration'])
-    return 0
-
-
-def get_fps(filestream, ffprobe_path="ffprobe"):
-    filestream.seek(0)
-    p = subprocess.Popen(
-        [ffprobe_path, "-i", "pipe:0", "-v", "quiet", "-print_format", "json", "-show_streams"],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    data = json.loads(p.communicate(input=filestream.read())[0].decode("utf-8"))
-    if data:
-        raw_fps = data["streams"][0]["avg_frame_rate"].split("/")
-        # if not int(raw_fps[0]) or not int(raw_fps[1]):
-        #     raw_fps = data["streams"][0]["r_frame_rate"].split("/")
-    else:
-        raw_fps = [0, 0]
-    if not int(raw_fps[0]) or not int(raw_fps[1]):
-        # Can happen sometimes if the file isn't on the drive
-        with open('tempfile', 'wb') as f:
-            filestream.seek(0)
-            f.write(filestream.read())
-        p = subprocess.Popen(
-            [ffprobe_path, "-i", "tempfile", "-v", "quiet", "-print_format", "json", "-show_streams"],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        data = json.loads(p.communicate()[0].decode("utf-8"))
-        raw_fps = data["streams"][0]["avg_frame_rate"].split("/")
-        if not int(raw_fps[0]) or not int(raw_fps[1]):
-            raw_fps = data["streams"][0]["r_frame_rate"].split("/")
-        os.remove('tempfile')
-
-    fps = int(raw_fps[0]) / int(raw_fps[1])
-    return fps
-
-
-def is_valid(file):
-    file.seek(0)
-    p = subprocess.Popen(
-        ["ffprobe", "-i", "pipe:0", "-v", "quiet", "-print_format", "json", "-show_streams", "-count_frames"],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    data = json.loads(p.communicate(input=file.read())[0].decode("utf-8"))
-    if data:
-        return data['streams'][0]['codec_type'] == "video"
-    return False
-
-
-def get_frames(file):
-    file.seek(0)
-    p = subprocess.Popen(
-        ["ffprobe", "-i", "pipe:0", "-v", "quiet", "-print_format", "json", "-show_streams", "-count_frames"],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    data = json.loads(p.communicate(input=file.read())[0].decode("utf-8"))
-    if (not data or not (data.get('streams', [{}])[0].get('nb_read_frames', False) or data.get('streams', [{}])[0].get('nb_frames', False))) and isinstance(file, BytesIO):
-        # Can happen sometimes if the file isn't on the drive
-        with open('tempfile', 'wb') as f:
-            file.seek(0)
-            f.write(file.read())
-        p = subprocess.Popen(
-            ["ffprobe", "-i", "tempfile", "-v", "quiet", "-print_format", "json", "-show_streams", "-count_frames"],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        data = json.loads(p.communicate()[0].decode("utf-8"))
-
-    frames = int(data["streams"][0].get('nb_read_frames', 0))
-    if not frames:
-        frames = int(data['streams'][0].get('nb_read_frames', 0))
-
-    return frames
-
-
-def has_audio(file):
-    file.seek(0)
-    audio = False
-    p = subprocess.Popen(
-        ["ffprobe", "-i", "pipe:0", "-v", "quiet", "-print_format", "json", "-show_streams", "-show_format"],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    data = json.loads(p.communicate(input=file.read())[0].decode("utf-8"))
-    for i in data['streams']:
-        if i['codec_type'] == 'audio':
-            audio = True
-
-    return audio
-
 
 def estimate_frames_to_pngs(width, height, frames):
     # PIXEL_TO_SIZE = 0.5812  # 1x1 pixel is .581 in bytes
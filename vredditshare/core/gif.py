@@ -3,10 +3,12 @@ from operator import itemgetter
 
 import os
 import importlib
+import threading
 import praw
 from vredditshare.core import constants as consts
 from vredditshare.hosts import NO_NSFW, ONLY_NSFW, GifFile, Gif as NewGif, GifHost
 from vredditshare.core.credentials import CredentialsLoader
+from vredditshare.core.transcode import could_fit
 
 def get_config_list(string):
     if string:
@@ -16,45 +18,59 @@ def get_config_list(string):
 
 class GifHostManager:
     hosts = []
-    reddit: praw.Reddit = None
+    # Requests run on several threads and PRAW isn't thread safe, so the Reddit instance is kept per thread
+    _local = threading.local()
     vid_priority = []
     gif_priority = []
     host_names = {}
+    _setup_lock = threading.Lock()
 
     def __init__(self, reddit=None):
         if not self.hosts:
-            # Get excluded hosts
-            excluded_hosts = get_config_list(CredentialsLoader.get_credentials()["general"].get("exclude_hosts", ""))
-            disable_upload = get_config_list(CredentialsLoader.get_credentials()["general"].get("disable_upload", ""))
-
-            # Dynamically load gif hosts
-            files = os.listdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../hosts"))
-            for f in files:
-                #  __init__.py or __pycache__
-                if f[:2] != "__" and f[-3:] == ".py":
-                    i = importlib.import_module("." + f[:-3], 'vredditshare.hosts')
-            hosts = []
-            for host in self._get_all_subclasses(GifHost):
-                host.ghm = self
-                if host.name not in excluded_hosts:
-                    if host.name in disable_upload:
-                        host.can_gif = False
-                        host.can_vid = False
-                    hosts.append([host, host.priority])
-            GifHostManager.hosts = [i[0] for i in sorted(hosts, key=itemgetter(1))]
-            # Create the priority lists
-            # vid_priority = [[i, i.vid_len_limit] for i in self.hosts if i.can_vid]
-            GifHostManager.vid_priority = [i for i in sorted(GifHostManager.hosts, key=lambda x: (x.priority,
-                                           x.vid_len_limit == 0, x.vid_len_limit)) if i.can_vid]
-            # gif_priority = [[i, i.gif_size_limit] for i in self.hosts if i.can_gif]
-            GifHostManager.gif_priority = [i for i in sorted(GifHostManager.hosts, key=lambda x: (x.priority,
-                                           x.gif_size_limit == 0, x.gif_size_limit)) if i.can_gif]
-            # GifHostManager.gif_priority = [i[0] for i in sorted(gif_priority, key=itemgetter(1))]
-            GifHostManager.host_names = {i.name: i for i in self.hosts}
-
-            # print("priority", self.hosts, self.vid_priority, self.gif_priority)
-        if not self.reddit:
-            GifHostManager.reddit = reddit
+            # Workers can make their first manager at the same time, only one of them sets the hosts up
+            with GifHostManager._setup_lock:
+                if not GifHostManager.hosts:
+                    self._load_hosts()
+        if reddit:
+            GifHostManager._local.reddit = reddit
+
+    @property
+    def reddit(self) -> Optional[praw.Reddit]:
+        return getattr(GifHostManager._local, "reddit", None)
+
+    def _load_hosts(self):
+        # Get excluded hosts
+        excluded_hosts = get_config_list(CredentialsLoader.get_credentials()["general"].get("exclude_hosts", ""))
+        disable_upload = get_config_list(CredentialsLoader.get_credentials()["general"].get("disable_upload", ""))
+
+        # Dynamically load gif hosts
+        files = os.listdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../hosts"))
+        for f in files:
+            #  __init__.py or __pycache__
+            if f[:2] != "__" and f[-3:] == ".py":
+                i = importlib.import_module("." + f[:-3], 'vredditshare.hosts')
+        hosts = []
+        for host in self._get_all_subclasses(GifHost):
+            host.ghm = self
+            if host.name not in excluded_hosts:
+                if host.name in disable_upload:
+                    host.can_gif = False
+                    host.can_vid = False
+                hosts.append([host, host.priority])
+        hosts = [i[0] for i in sorted(hosts, key=itemgetter(1))]
+        # Create the priority lists
+        # vid_priority = [[i, i.vid_len_limit] for i in self.hosts if i.can_vid]
+        GifHostManager.vid_priority = [i for i in sorted(hosts, key=lambda x: (x.priority,
+                                       x.vid_len_limit == 0, x.vid_len_limit)) if i.can_vid]
+        # gif_priority = [[i, i.gif_size_limit] for i in self.hosts if i.can_gif]
+        GifHostManager.gif_priority = [i for i in sorted(hosts, key=lambda x: (x.priority,
+                                       x.gif_size_limit == 0, x.gif_size_limit)) if i.can_gif]
+        # GifHostManager.gif_priority = [i[0] for i in sorted(gif_priority, key=itemgetter(1))]
+        GifHostManager.host_names = {i.name: i for i in hosts}
+        # Set last, other threads take a non-empty host list to mean everything is ready
+        GifHostManager.hosts = hosts
+
+        # print("priority", self.hosts, self.vid_priority, self.gif_priority)
 
     def _get_all_subclasses(self, parent_class):
         classes = []
@@ -118,19 +134,33 @@ class GifHostManager:
         if (host.NSFW == ONLY_NSFW) and not gif.nsfw:
             return False
 
+        # Size or duration can be None on a FileEstimate if the host didn't tell us, those pass
         if gif_file.type == consts.GIF:
-            if host.can_gif and (host.gif_size_limit >= gif_file.size or host.gif_size_limit == 0) and \
-               (host.gif_frame_limit >= gif_file.frames or host.gif_frame_limit == 0):
+            # Frame limit is checked last so the frames are only counted if they actually matter
+            if host.can_gif and (host.gif_size_limit == 0 or gif_file.size is None or
+                                 host.gif_size_limit >= gif_file.size) and \
+               (host.gif_frame_limit == 0 or host.gif_frame_limit >= gif_file.frames):
                 return True
         else:
-            if host.can_vid and (host.vid_len_limit >= gif_file.duration or host.vid_len_limit == 0) and \
-               (host.vid_size_limit >= gif_file.size or host.vid_size_limit == 0) and \
+            if host.can_vid and (host.vid_len_limit == 0 or gif_file.duration is None or
+                                 host.vid_len_limit >= gif_file.duration) and \
+               (host.vid_size_limit == 0 or gif_file.size is None or host.vid_size_limit >= gif_file.size) and \
                     (host.audio == gif_file.audio or not gif_file.audio):
                 # Audio logic: if they match or if audio is false (meaning it doesn't matter)
 
                 return True
         return False
 
+    def admits(self, gif: NewGif):
+        """Whether any host could take this gif going off the host's own numbers, before anything is downloaded.
+        Gifs that can't be estimated are let through, as are videos that are only too big since they can be
+        transcoded down"""
+        estimates = gif.estimate()
+        if not estimates:
+            return True
+        return any(self.get_upload_host(gif, file=estimate) or could_fit(self, gif, estimate)
+                   for estimate in estimates)
+
     def __getitem__(self, item):
         return self.host_names.get(item, None)
 
@@ -0,0 +1,66 @@
+import threading
+import praw
+from vredditshare.core.credentials import CredentialsLoader
+from vredditshare.core import constants as consts
+from vredditshare.utils.cache import TTLCache
+
+
+class ModeratedSubreddits:
+    """Cache of the subreddits the bot moderates. Listing them is a paginated request, so rather than making every
+    AutoModerator summon wait on it, we keep the list around and refresh it in the background once it gets old"""
+    ttl = 15 * 60
+    _cache = TTLCache(ttl)
+    _refresh_lock = threading.Lock()
+    # PRAW isn't thread safe, so the background refresh has a Reddit instance of its own instead of borrowing the
+    # worker's. Only used while holding the refresh lock
+    _refresher = None
+
+    @classmethod
+    def get(cls, reddit) -> set:
+        """Fullnames of the subreddits the bot moderates"""
+        entry = cls._cache.get_entry("names")
+        # Nothing cached yet, we have to wait for it
+        if entry is None:
+            return cls.refresh(reddit)
+        names, fresh = entry
+        # Hand out the old list while a new one is fetched, unless someone is already fetching it
+        if not fresh and cls._refresh_lock.acquire(blocking=False):
+            threading.Thread(target=cls._background_refresh, daemon=True, name="moderated-refresh").start()
+        return names
+
+    @classmethod
+    def refresh(cls, reddit) -> set:
+        with cls._refresh_lock:
+            # Whoever held the lock before us may have just fetched it
+            names = cls._cache.get("names")
+            if names is not None:
+                return names
+            return cls._fetch(reddit)
+
+    @classmethod
+    def _background_refresh(cls):
+        try:
+            if cls._refresher is None:
+                credentials = CredentialsLoader.get_credentials()
+                cls._refresher = praw.Reddit(user_agent=consts.user_agent,
+                                             client_id=credentials['reddit']['client_id'],
+                                             client_secret=credentials['reddit']['client_secret'],
+                                             username=credentials['reddit']['username'],
+                                             password=credentials['reddit']['password'])
+            cls._fetch(cls._refresher)
+        except Exception as e:
+            # The old list is still usable, try again next time
+            print("Couldn't refresh moderated subreddits", e)
+        finally:
+            cls._refresh_lock.release()
+
+    @classmethod
+    def _fetch(cls, reddit) -> set:
+        names = {i.name for i in reddit.user.me().moderated()}
+        cls._cache.set("names", names)
+        return names
+
+    @classmethod
+    def invalidate(cls):
+        """Forget the list, used when we start moderating somewhere new"""
+        cls._cache.invalidate("names")
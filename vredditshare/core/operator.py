@@ -1,5 +1,6 @@
 from praw.models import Redditor
 import vredditshare.core.constants as consts
+import threading
 import json
 
 
@@ -7,7 +8,8 @@ class Operator:
     user = None
     reddit = None
     testing = True  # Set to avoid errors in unit testing, this should be set during startup
-    data = None
+    # Request info is kept per thread since requests can be processed by several workers at once
+    _local = threading.local()
     """Used for messaging the operating user of the bot"""
     def __init__(self, user: Redditor, testing_mode):
         Operator.user = user
@@ -20,24 +22,31 @@ class Operator:
     @classmethod
     def message(cls, message, subject="Notification", print_message=True, always_message=False):
         if not cls.testing or always_message:
-            cls.user.message(consts.short_name + " - " + subject, message[:10000])
+            # Worker threads message through their own Reddit instance
+            user = getattr(cls._local, "user", None) or cls.user
+            user.message(consts.short_name + " - " + subject, message[:10000])
         if print_message:
             print(message)
 
     @classmethod
     def context_message(cls, message, subject="Notification", print_message=True, always_message=False):
-        if cls.data:
-            pretty_data = json.dumps(cls.data, indent=4).replace("\n", "\n    ")
+        data = getattr(cls._local, "data", None)
+        if data:
+            pretty_data = json.dumps(data, indent=4).replace("\n", "\n    ")
         else:
             pretty_data = "No Data"
         cls.message(f"{message}\n\n---\n\nRequest Data:\n\n    {pretty_data}"[:1000], subject, False, always_message)
         if print_message:
             print(message)
 
+    @classmethod
+    def set_thread_user(cls, user: Redditor):
+        cls._local.user = user
+
     @classmethod
     def set_request_info(cls, data):
-        cls.data = data
+        cls._local.data = data
 
     def unset_request_info(self):
-        Operator.data = None
+        Operator._local.data = None
 
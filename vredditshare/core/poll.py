@@ -0,0 +1,51 @@
+import time
+from collections import deque
+from vredditshare.core import constants as consts
+
+
+class PollScheduler:
+    """Decides how long to wait between inbox checks. We check often while requests are coming in and back off
+    towards sleep_time when the inbox is quiet"""
+    def __init__(self, min_interval=consts.min_sleep_time, max_interval=consts.sleep_time, backoff=1.5,
+                 history=500):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        # Stats for each pass of the inbox, used to tune the intervals
+        self.stats = deque(maxlen=history)
+        self._pass_start = None
+
+    def start_pass(self):
+        self._pass_start = time.monotonic()
+
+    def end_pass(self, messages, failures=0):
+        """Record a finished pass over the inbox and return how long to wait before the next one. Messages that
+        failed stay in the inbox, so a pass that only saw failures doesn't count as busy"""
+        duration = time.monotonic() - self._pass_start
+        if messages > failures:
+            # Busy, check again soon
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.stats.append({"time": time.time(), "messages": messages, "failures": failures,
+                           "duration": duration, "interval": self.interval})
+        if messages:
+            print(f"Handled {messages} message{'s' if messages != 1 else ''} in {round(duration, 1)}s, "
+                  f"checking again in {round(self.interval)}s")
+        return self.interval
+
+    def summary(self):
+        """Averages over the recorded passes"""
+        if not self.stats:
+            return {}
+        busy = [s for s in self.stats if s['messages'] > s['failures']]
+        return {
+            "passes": len(self.stats),
+            "busy_passes": len(busy),
+            "messages": sum(s['messages'] for s in self.stats),
+            "failures": sum(s['failures'] for s in self.stats),
+            "average_duration": sum(s['duration'] for s in self.stats) / len(self.stats),
+            "average_busy_duration": sum(s['duration'] for s in busy) / len(busy) if busy else 0,
+            "average_interval": sum(s['interval'] for s in self.stats) / len(self.stats),
+        }
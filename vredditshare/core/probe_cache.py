@@ -0,0 +1,91 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from vredditshare.core.credentials import CredentialsLoader
+from vredditshare.utils.cache import TTLCache
+
+"""Probe results keyed by a hash of the media's bytes, so media we have already seen doesn't need to go through
+ffprobe again. Recent results are kept in memory. If probe_cache is set to a path in the general section of the
+credentials file, results are also kept in a sqlite database there, up to probe_cache_size MB."""
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(filestream):
+    """Hash of the media's bytes, filestream can be a file-like object or a path"""
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(filestream, str):
+        with open(filestream, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+    elif hasattr(filestream, "getbuffer"):   # BytesIO and MediaBuffer
+        with filestream.getbuffer() as buffer:
+            h.update(buffer)
+    else:
+        filestream.seek(0)
+        for chunk in iter(lambda: filestream.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+        filestream.seek(0)
+    return h.hexdigest()
+
+
+class ProbeCache:
+    def __init__(self, memory_size=256, path=None, max_size=50):
+        self.memory = TTLCache(float("inf"), memory_size)
+        self.path = path
+        self.max_bytes = max_size * 1000000
+        self._db = None
+        self._lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS probes (key TEXT PRIMARY KEY, fields TEXT NOT NULL, "
+                             "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)")
+            self._db.commit()
+
+    @classmethod
+    def from_config(cls):
+        general = CredentialsLoader.get_credentials()['general']
+        return cls(path=general.get('probe_cache', None), max_size=int(general.get('probe_cache_size', 50)))
+
+    def get(self, key):
+        fields = self.memory.get(key)
+        if fields is None and self._db:
+            with self._lock:
+                row = self._db.execute("SELECT fields FROM probes WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._db.execute("UPDATE probes SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+            if row:
+                fields = json.loads(row[0])
+                self.memory.set(key, fields)
+        return fields
+
+    def set(self, key, fields):
+        self.memory.set(key, fields)
+        if self._db:
+            data = json.dumps(fields)
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO probes (key, fields, size, last_used) VALUES (?, ?, ?, ?)",
+                                 (key, data, len(data), time.time()))
+                self._evict()
+                self._db.commit()
+
+    def _evict(self):
+        """Drop the least recently used entries until we're under the size limit"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM probes").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM probes ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            stale.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM probes WHERE key = ?", stale)
+
+
+probe_cache = ProbeCache.from_config()
@@ -3,12 +3,18 @@ from vredditshare.core.context import CommentContext
 from vredditshare.core.reply import reply
 from vredditshare.core.gif import GifHostManager
 from vredditshare.core.reverse import reverse_mp4, reverse_gif
+from vredditshare.core.transcode import fit_to_host
 from vredditshare.core.history import check_database, add_to_database, delete_from_database
 from vredditshare.core import constants as consts
 from vredditshare.hosts import CannotUpload, UploadFailed, GifFile, Gif
 from vredditshare.core.constants import SUCCESS, USER_FAILURE, UPLOAD_FAILURE
 from vredditshare.core.operator import Operator
+from vredditshare.core.moderation import ModeratedSubreddits
 from vredditshare.utils.temp_folder import TempFolder
+from vredditshare.utils.single_flight import SingleFlight
+
+# Uploads currently being worked on, keyed by origin host and id
+uploads_in_flight = SingleFlight()
 
 
 def process_comment(reddit, comment=None, queue=None, original_context=None):
@@ -101,6 +107,27 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
         reply(context, gif)
         return SUCCESS
 
+    # If another request is already reuploading this gif, wait for it and share the result
+    key = (original_gif.host.name, original_gif.id)
+    uploaded_gif, shared = uploads_in_flight.do(key, reupload, ghm, context, original_gif)
+    if shared:
+        print("Sharing upload with another request for", original_gif)
+
+    # If there was an error, return it
+    if not isinstance(uploaded_gif, Gif):
+        return uploaded_gif
+
+    # Reply
+    print("Replying!", uploaded_gif.url)
+    result = reply(context, uploaded_gif)
+    if result:
+        return SUCCESS
+    else:
+        return UPLOAD_FAILURE
+
+
+def reupload(ghm, context, original_gif):
+    """Download the gif and upload it to a suitable host. Returns the uploaded Gif or a failure code"""
     # Analyze how the gif should be reversed
     # in_format, out_format = gif_host.analyze()
 
@@ -108,6 +135,11 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
     # if not in_format or not out_format:
     #     return USER_FAILURE
 
+    # Don't download anything if the host's own numbers already say nowhere can take it
+    if not ghm.admits(original_gif):
+        print("No host could take this going off what the host says, not downloading it")
+        return USER_FAILURE
+
     if not original_gif.analyze():
         return USER_FAILURE
 
@@ -121,6 +153,9 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
 
     if not options:
         print("File too large {}s {}MB".format(original_gif.files[0].duration, original_gif.files[0].size))
+        # See if a smaller encode fits somewhere instead
+        options = fit_to_host(ghm, original_gif)
+    if not options:
         cant_upload = True
     else:
         cant_upload = False
@@ -203,19 +238,10 @@ def process_comment(reddit, comment=None, queue=None, original_context=None):
     elif not uploaded_gif:
         return UPLOAD_FAILURE
 
-    if uploaded_gif:
-        # Add gif to database
-        # if reversed_gif.log:
-        add_to_database(original_gif, uploaded_gif)
-        # Reply
-        print("Replying!", uploaded_gif.url)
-        result = reply(context, uploaded_gif)
-        if result:
-            return SUCCESS
-        else:
-            return UPLOAD_FAILURE
-    else:
-        return UPLOAD_FAILURE
+    # Add gif to database. This happens before any waiting requests are released so that later requests find it
+    # if reversed_gif.log:
+    add_to_database(original_gif, uploaded_gif)
+    return uploaded_gif
 
 
 def process_mod_invite(reddit, message):
@@ -225,6 +251,7 @@ def process_mod_invite(reddit, message):
         subreddit = reddit.subreddit(subreddit_name)
         try:
             subreddit.mod.accept_invite()
+            ModeratedSubreddits.invalidate()
             print("Accepted moderatership at", subreddit_name)
             return subreddit_name
         except praw.exceptions.APIException as e:
@@ -0,0 +1,72 @@
+import re
+from typing import Optional
+from vredditshare.utils.cache import TTLCache
+from vredditshare.utils.single_flight import SingleFlight
+
+"""Submission and subreddit data shared between context resolution and the Reddit hosts so that a request only has
+to fetch any one submission once"""
+
+TTL = 10 * 60
+MAX_SIZE = 2048
+
+VREDDIT = re.compile(r"https?://v\.redd\.it/(\w+)")
+
+_submissions = TTLCache(TTL, MAX_SIZE)
+_videos = TTLCache(TTL, MAX_SIZE)     # v.redd.it id to submission id
+_subreddits = TTLCache(TTL, MAX_SIZE)
+_fetches = SingleFlight()
+
+
+class SubmissionInfo:
+    """The parts of a submission we care about"""
+    def __init__(self, submission):
+        # Accessing any of these on a lazy submission fetches it, which raises if it's inaccessible
+        self.id = submission.id
+        self.url = submission.url
+        self.is_self = submission.is_self
+        self.over_18 = submission.over_18
+        self.is_video = submission.is_video
+        self.media = submission.media
+        self.subreddit = submission.subreddit.display_name
+
+    def __repr__(self):
+        return f"SubmissionInfo({self.id})"
+
+
+def add_submission(submission) -> SubmissionInfo:
+    """Cache a submission we already have. Only fetches if it's lazy and we haven't seen it yet"""
+    info = _submissions.get(submission.id)
+    if info is None:
+        info = SubmissionInfo(submission)
+        _submissions.set(info.id, info)
+        # Crossposts also link to the v.redd.it url but don't carry the media, only index the original
+        if info.is_video and info.media:
+            video = VREDDIT.findall(info.url)
+            if video:
+                _videos.set(video[0], info.id)
+    return info
+
+
+def get_submission(reddit, submission_id) -> SubmissionInfo:
+    info = _submissions.get(submission_id)
+    if info is None:
+        info, _ = _fetches.do(("submission", submission_id), add_submission, reddit.submission(submission_id))
+    return info
+
+
+def find_video_submission(video_id) -> Optional[SubmissionInfo]:
+    """The submission for a v.redd.it id, if we've come across it already"""
+    submission_id = _videos.get(video_id)
+    if submission_id:
+        return _submissions.get(submission_id)
+    return None
+
+
+def is_subreddit_nsfw(subreddit) -> bool:
+    name = subreddit.display_name.lower()
+    nsfw = _subreddits.get(name)
+    if nsfw is None:
+        # Why no underscore
+        nsfw, _ = _fetches.do(("subreddit", name), lambda: bool(subreddit.over18))
+        _subreddits.set(name, nsfw)
+    return nsfw
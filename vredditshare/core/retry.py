@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from pony.orm import Database, PrimaryKey, Required, Optional, db_session
+from vredditshare.core.history import bind_db
+from vredditshare.core import constants as consts
+
+"""Requests that failed to upload are retried on later passes with an increasing delay until we give up on them"""
+
+db = Database()
+
+
+class RetryMessages(db.Entity):
+    message_id = PrimaryKey(str)
+    attempts = Required(int)
+    next_attempt = Required(datetime)
+    last_reason = Optional(str)
+
+
+bind_db(db)
+
+
+def retry_delay(attempts):
+    """How long to wait before trying a message again after it has failed this many times"""
+    return timedelta(seconds=min(consts.retry_base_delay * 2 ** (attempts - 1), consts.retry_max_delay))
+
+
+def is_due(message_id):
+    """Is the message new or has it waited long enough since its last failure?"""
+    with db_session:
+        retry = RetryMessages.get(message_id=message_id)
+        return retry is None or retry.next_attempt <= datetime.utcnow()
+
+
+def record_failure(message_id, reason=None):
+    """Schedule the next attempt for a failed message. Returns True if we have run out of attempts"""
+    with db_session:
+        retry = RetryMessages.get(message_id=message_id)
+        if retry is None:
+            retry = RetryMessages(message_id=message_id, attempts=0, next_attempt=datetime.utcnow())
+        retry.attempts += 1
+        retry.next_attempt = datetime.utcnow() + retry_delay(retry.attempts)
+        retry.last_reason = reason or ""
+        if retry.attempts >= consts.max_retries:
+            retry.delete()
+            return True
+        return False
+
+
+def clear_retry(message_id):
+    with db_session:
+        retry = RetryMessages.get(message_id=message_id)
+        if retry:
+            retry.delete()
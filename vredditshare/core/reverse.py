@@ -1,20 +1,154 @@
+import csv
 import subprocess
 import os
 import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 from vredditshare.core import constants as consts
 from vredditshare.hosts import GifFile
-from vredditshare.utils.temp_folder import TempFolder
-
-
-def zeros(number, num_zeros=6):
-    string = str(number)
-    return "".join(["0" for i in range(num_zeros - len(string))]) + string
+from vredditshare.core.credentials import CredentialsLoader
+from vredditshare.utils.process_file import process_path
+from vredditshare.utils.media_buffer import MediaBuffer
+from vredditshare.utils.gif_info import GifParseError, is_gif, parse_gif
+
+# Seconds of video in each piece when reversing, the cut happens at the next keyframe after this
+REVERSE_SEGMENT_TIME = float(CredentialsLoader.get_credentials()['general'].get('reverse_segment_time', 2))
+# How many pieces are reversed at once, defaults to the number of cores
+REVERSE_WORKERS = int(CredentialsLoader.get_credentials()['general'].get('reverse_workers', 0))
+# Most decoded frames a gif can have (MB) before it's reversed through PNGs instead, which are much smaller
+REVERSE_FRAME_BUFFER = float(CredentialsLoader.get_credentials()['general'].get('reverse_frame_buffer', 1000)) * 1000000
+
+if platform.system() == 'Windows':
+    ffmpeg = 'ffmpeg.exe'
+else:
+    ffmpeg = 'ffmpeg'
+
+
+def _gifski_command(gifski, out_file, fps):
+    return [gifski, "-o", str(out_file), "--fps", str(max(round(fps), 1))]
+
+
+def _frame_size(header: bytes):
+    """Bytes in each frame of a yuv4mpeg stream going off its header. Only the 4:4:4 ffmpeg is asked for"""
+    params = {param[:1]: param[1:] for param in header.split()[1:]}
+    if not params.get(b"C", b"").startswith(b"444"):
+        return None
+    return int(params[b"W"]) * int(params[b"H"]) * 3
+
+
+def decode_frames(path, ffmpeg=ffmpeg, max_size=REVERSE_FRAME_BUFFER):
+    """Decode every frame of a gif into a MediaBuffer as raw yuv4mpeg frames. Frames are a fixed size, so they can be
+    read back in any order without an index. Returns (header, frame size, frame count, buffer), or None if ffmpeg
+    couldn't decode it or the frames come to more than max_size bytes"""
+    p = subprocess.Popen([ffmpeg, "-loglevel", "error", "-i", path, "-vsync", "0", "-pix_fmt", "yuv444p",
+                          "-f", "yuv4mpegpipe", "-"], stdout=subprocess.PIPE)
+    buffer = MediaBuffer(prefix="frames")
+    count = 0
+    try:
+        header = p.stdout.readline()
+        frame_size = _frame_size(header) if header.startswith(b"YUV4MPEG2") else None
+        if frame_size:
+            # Each frame is a FRAME line followed by the picture, only the picture is kept
+            while p.stdout.readline().startswith(b"FRAME"):
+                if (count + 1) * frame_size > max_size:
+                    print("Decoded frames went over", max_size / 1000000, "MB")
+                    p.kill()
+                    count = 0
+                    break
+                frame = p.stdout.read(frame_size)
+                if len(frame) != frame_size:
+                    break
+                buffer.write(frame)
+                count += 1
+    except BaseException:
+        p.kill()
+        buffer.close()
+        raise
+    finally:
+        p.stdout.close()
+    if p.wait() != 0 or not count:
+        buffer.close()
+        return None
+    return header, frame_size, count, buffer
+
+
+def _gifski_y4m(in_path, out_file: Path, fps, ffmpeg, gifski):
+    """Feed the frames to gifski as a yuv4mpeg stream, last frame first"""
+    decoded = decode_frames(in_path, ffmpeg)
+    if decoded is None:
+        return False
+    header, frame_size, count, frames = decoded
+    print("Frames:", count, "raw size", len(frames) / 1000000)
+    # Quiet so the progress bar can't fill up the stderr pipe while we're still writing frames
+    p = subprocess.Popen(_gifski_command(gifski, out_file, fps) + ["--quiet", "-"], stdin=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    try:
+        p.stdin.write(header)
+        with frames.getbuffer() as view:
+            for i in range(count - 1, -1, -1):
+                p.stdin.write(b"FRAME\n")
+                p.stdin.write(view[i * frame_size:(i + 1) * frame_size])
+    except BrokenPipeError:
+        # gifski quit early, most likely because it's too old to read from stdin
+        pass
+    finally:
+        frames.close()
+        try:
+            p.stdin.close()
+        except BrokenPipeError:
+            pass
+    output = p.stderr.read()
+    p.wait()
+    if p.returncode != 0:
+        print("gifski couldn't take the frames", output)
+    return p.returncode == 0
+
+
+def _gifski_png(in_path, folder: Path, out_file: Path, fps, ffmpeg, gifski):
+    """Export the frames as PNGs and give them to gifski listed last to first"""
+    frames_folder = folder / "frames"
+    frames_folder.mkdir()
+    subprocess.Popen(
+        [ffmpeg, "-loglevel", "quiet", "-i", in_path, "-vsync", "0", frames_folder / "frame%06d.png"]
+    ).communicate()
+    # The names sort in frame order, so the list backwards is the gif backwards
+    files = sorted(frames_folder.iterdir(), reverse=True)
+    print("Frames:", len(files), "pngs size", sum(f.stat().st_size for f in files) / 1000000)
+    # Relative names so thousands of frames don't run into the command line length limit
+    p = subprocess.Popen(_gifski_command(gifski, out_file.resolve(), fps) + ["--nosort"] + [f.name for f in files],
+                         cwd=frames_folder, stderr=subprocess.PIPE)
+    output = p.communicate()[1]
+    if p.returncode != 0:
+        print("gifski couldn't make the gif", output)
+    return p.returncode == 0
+
+
+def _needs_png(image):
+    """Whether a gif has to go through PNGs. yuv4mpeg can't carry transparency, and gifs whose raw frames would be
+    too big to buffer are better off compressed"""
+    if not is_gif(image):
+        return False
+    try:
+        info = parse_gif(image)
+    except GifParseError:
+        return False
+    if info.transparent:
+        print("Gif has transparency, keeping it with PNG frames")
+        return True
+    if info.width * info.height * 3 * info.frame_count > REVERSE_FRAME_BUFFER:
+        print("Gif has too many frames to buffer, using PNG frames")
+        return True
+    return False
 
 
 def reverse_gif(image_file: GifFile, folder: Path, path=False, format=consts.GIF):
     """
+    Decodes the frames with ffmpeg and streams them to gifski in reverse, holding them in a buffer that moves to
+    disk if it gets big. Gifs with transparency or too many frames to buffer go through RGBA PNGs instead, as do
+    gifs gifski can't read from stdin.
     :param image: filestream to reverse
     :param path: if you just want the string path to the file instead of the filestream
     :return: filestream of a gif
@@ -23,181 +157,166 @@ def reverse_gif(image_file: GifFile, folder: Path, path=False, format=consts.GIF
     image.seek(0)
     if platform.system() == 'Windows':
         ffmpeg = 'ffmpeg.exe'
-        ffprobe = 'ffprobe'
         gifski = 'gifski.exe'
     else:
         ffmpeg = 'ffmpeg'
-        ffprobe = 'ffprobe'
         gifski = 'gifski'
 
     print("Reversing gif...")
-
-    frames_folder = folder / "frames"
-    frames_folder.mkdir()
-
-    filename = folder / ("in." + format)
-
-    with open(filename, "wb") as f:
-        f.write(image.read())
+    start = time.time()
 
     fps = image_file.info.fps
     print("FPS:", fps)
 
-    print("Exporting frames...")
-
-    # Reverse filenames
-    subprocess.Popen(
-        [ffmpeg, "-loglevel", "quiet", "-i", str(filename), "-vsync", "0", frames_folder / "original%06d.png"]
-    ).communicate()
-
-    os.remove(filename)
-
-    # Reverse filenames
-    for i in os.walk(frames_folder):
-        files = i[2]
-        break
+    out_file = folder / "temp.gif"
+    with process_path(image, "in." + format) as in_path:
+        if _needs_png(image):
+            _gifski_png(in_path, folder, out_file, fps, ffmpeg, gifski)
+        elif not _gifski_y4m(in_path, out_file, fps, ffmpeg, gifski):
+            print("Falling back to PNG frames...")
+            _gifski_png(in_path, folder, out_file, fps, ffmpeg, gifski)
 
-    counter = len(files)
-    for i in range(1, len(files) + 1):
-        os.rename(frames_folder / "original{}.png".format(zeros(i)),
-                  frames_folder / "frame{}.png".format(zeros(counter)))
-        counter -= 1
-
-    # Statistics
-    for i in os.walk(frames_folder):
-        files = i[2]
-        break
-
-    pics_size = sum(os.path.getsize(frames_folder / f) for f in files)
-    print(pics_size)
-
-    print("Rebuilding gif...")
-
-    if platform.system() == 'Windows':
-        p = subprocess.Popen(
-            [gifski, "-o", str(folder / "temp.gif"), "--fps", str(max(round(fps), 1)), str(frames_folder / "frame*.png")],
-            shell=True,
-            stderr=subprocess.PIPE
-        )
-    else:
-        p = subprocess.Popen(
-            [f"{gifski} -o {folder / 'temp.gif'} --fps {str(max(round(fps), 1))} {frames_folder / 'frame*.png'}"],
-            shell=True,
-            stderr=subprocess.PIPE
-        )
-
-    output = p.communicate()
-
-    print(output)
-
-    print("done")
-
-    # More statistics
-    gif_size = os.path.getsize(folder / "temp.gif")
-    print("pngs size, gif size, ratio", pics_size / 1000000, gif_size / 1000000, gif_size / pics_size)
+    gif_size = os.path.getsize(out_file) if out_file.exists() else 0
+    print(f"Reversed gif in {round(time.time() - start, 2)}s, gif size", gif_size / 1000000)
 
     if path:
         return "temp.gif"
     else:
-        return open(folder / "temp.gif", "rb")
+        return open(out_file, "rb")
+
+
+def _run(command):
+    """Run an ffmpeg command, returns whether it worked and what it printed"""
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    return p.returncode == 0, output.decode(errors="replace")
+
+
+def _segment(path, segments_folder: Path, format, segment_time, codec):
+    """Run the segment muxer on the video track. Returns each piece with its length in seconds, empty if ffmpeg
+    failed"""
+    segments_folder.mkdir()
+    segment_list = segments_folder / "segments.csv"
+    # Audio is left out, it's reversed in one go afterwards so there's no encoder priming at every seam
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-i", path, "-map", "0:v:0", "-an"] + codec +
+                        ["-f", "segment", "-segment_time", str(segment_time), "-reset_timestamps", "1",
+                         "-segment_list", str(segment_list), "-segment_list_type", "csv",
+                         str(segments_folder / f"segment%05d.{format}")])
+    if not ok:
+        print("Couldn't split video", response)
+        return []
+    with open(segment_list, newline="") as f:
+        return [(segments_folder / row[0], float(row[2]) - float(row[1])) for row in csv.reader(f) if row]
+
+
+def split_segments(path, folder: Path, format=consts.MP4, segment_time=REVERSE_SEGMENT_TIME):
+    """Cut a video into pieces of about segment_time seconds. Cuts can only land on keyframes, so if the keyframes
+    are too far apart for that, the video is re-encoded with keyframes where the cuts should go. Returns the pieces in
+    order, empty if it couldn't be cut"""
+    segments = _segment(path, folder / "segments", format, segment_time, ["-c", "copy"])
+    # Pieces run over a little when a keyframe lands just after a cut, only re-encode when they're way off
+    if segments and max(length for _, length in segments) > segment_time * 3:
+        print("Keyframes are too far apart to split on, re-encoding with more")
+        # Always mp4, the source's container might not take h264
+        segments = _segment(path, folder / "keyframed", consts.MP4, segment_time,
+                            ["-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+                             "-force_key_frames", f"expr:gte(t,n_forced*{segment_time})"])
+    return [segment for segment, _ in segments]
+
+
+def _reverse_segment(segment: Path, out_file: Path, codec, threads):
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-i", str(segment), "-vf", "reverse", "-an"] + codec +
+                        ["-threads", str(threads), "-y", str(out_file)])
+    if not ok:
+        print("Couldn't reverse", segment.name, response)
+    return ok
+
+
+def _reverse_whole(path, output_file: Path, codec, audio):
+    """Reverse the whole video in one go. -vf reverse holds every frame in memory, so this is only the fallback"""
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-i", path, "-vf", "reverse"] + codec +
+                        (["-af", "areverse"] if audio else []) + ["-y", str(output_file)])
+    if not ok:
+        print("Couldn't reverse video", response)
+    return ok
+
+
+def _add_reversed_audio(video_file: Path, path, output_file: Path):
+    """Mux the source's audio, reversed as a whole, with the reversed video. areverse only has to hold the audio so
+    this is cheap next to reversing the frames"""
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-i", str(video_file), "-i", path, "-map", "0:v:0",
+                         "-map", "1:a:0?", "-c:v", "copy", "-af", "areverse", "-y", str(output_file)])
+    if not ok:
+        print("Couldn't add the reversed audio", response)
+    return ok
+
+
+def _reverse_segmented(path, folder: Path, output_file: Path, codec, audio, format, output):
+    """Reverse the video a piece at a time and join the pieces last to first, then add the audio reversed as a
+    whole. Returns whether it worked"""
+    start = time.time()
+    segments = split_segments(path, folder, format)
+    if not segments:
+        return False
+
+    reversed_folder = folder / "reversed"
+    reversed_folder.mkdir()
+    reversed_segments = [reversed_folder / f"{segment.stem}.{output}" for segment in segments]
+    workers = max(min(REVERSE_WORKERS or os.cpu_count() or 1, len(segments)), 1)
+    # Split the cores between the encodes running at once
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reverse") as pool:
+        results = list(pool.map(_reverse_segment, segments, reversed_segments, repeat(codec), repeat(threads)))
+    if not all(results):
+        return False
+
+    # Last piece first
+    concat_list = folder / "segments.txt"
+    with open(concat_list, "w") as f:
+        for segment in reversed(reversed_segments):
+            escaped = str(segment).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    video_file = folder / f"joined.{output}" if audio else output_file
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(concat_list),
+                         "-c", "copy", "-y", str(video_file)])
+    if not ok:
+        print("Couldn't join reversed segments", response)
+        return False
+    if audio and not _add_reversed_audio(video_file, path, output_file):
+        return False
+    print(f"Reversed {len(segments)} segments with {workers} workers in {round(time.time() - start, 2)}s")
+    return True
 
 
 def reverse_mp4(mp4, folder: Path, audio=False, format=consts.MP4, output=consts.MP4):
     """
+    Reverses a video a piece at a time. -vf reverse keeps every decoded frame in memory, so the video is cut at
+    keyframes, the pieces are reversed side by side and then joined back together last to first. Memory use depends
+    on the size of the pieces instead of the whole video. If that doesn't work out, the whole video is reversed at
+    once like it used to be.
     :param mp4: filestream to reverse (must be a mp4)
     :return: filestream of an mp4
     """
     print("Reversing {} into {}...".format(format, output))
 
-    mp4.seek(0)
-
     # Create the params for the command
 
-    params = {"loglevel": "info", "audio": ""}
-
     if output == consts.MP4:
-        params['codec'] = "-c:v libx264 -q:v 0"
+        codec = ["-c:v", "libx264", "-q:v", "0"]
     elif output == consts.WEBM:
-        params['codec'] = "-c:v libvpx -crf 8 -b:v 1500K"
-
-    if audio:
-        params['audio'] = "-af areverse "
-
-    params['output_file'] = folder / f"temp.{output}"
-
-    # Assemble command
-    command = "ffmpeg -loglevel {loglevel} -i pipe:0 -vf reverse {codec} {audio}-y {output_file}".format(output=output,
-                                                                                                         **params)
-
-    # command = "ffmpeg -loglevel {loglevel} -i pipe:0 -y temp.{output}".format(output=output, **params)
-
-    # print(command)
-    command = command.split()
-
-    p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    response = p.communicate(input=mp4.read())
-
-    # print(response[0].decode() if response[0] else None, response[1].decode() if response[1] else None)
-
-    response = response[0].decode()
-    # print(os.path.getsize('temp.' + output))
-
-    # Weird thing
-    # A blank mp4 is 48 bytes, a blank webm is ~~632 bytes~~
-    # Blank webm might be larger actually, using a percentage of the size of the original
-    # if output == consts.WEBM:
-    #     print("Checking if under", mp4.getbuffer().nbytes / 100)
-    if "partial file" in response or "Cannot allocate memory" in response or \
-            os.path.getsize('temp.' + output) <= (48 if output == consts.MP4 else (mp4.getbuffer().nbytes / 100)):
-        """"frame=    0 fps=0.0 q=0.0 size=       1kB time=00:00:00.00 bitrate=N/A"""
-        """"frame=    0 fps=0.0 q=0.0 size=       0kB time=00:00:00.00"""
-        print("FFMPEG gave weird error, putting in file to reverse")
-        in_file = folder / ("source." + format)
-        command[4] = in_file
-        mp4.seek(0)
-        with open(in_file, 'wb') as f:
-            f.write(mp4.read())
-
-        p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        response = p.communicate()[0].decode()
-
-        # print(response)
-        # Did we fail again?
-        # if "partial file" in response or "Cannot allocate memory" in response or os.path.getsize('temp.' + output) <= (48 if output == consts.MP4 else 632):
-        #     # Just export frames and reconstruct
-        #     print("Exporting frames")
-        #     # Get FPS
-        #     # Gross hack, fix it later with integrated GifFile metadata
-        #     fps = get_fps(in_file)
-        #
-        #     os.chdir("temp")
-        #
-        #     # Export frames
-        #     p = subprocess.Popen(
-        #         [ffmpeg, "-loglevel", "quiet", "-i", "../" + in_file, "original%06d.png"]
-        #     )
-        #
-        #     response = p.communicate()
-        #
-        #     print("Renaming...")
-        #     # Reverse filenames
-        #     for i in os.walk("."):
-        #         files = i[2]
-        #         break
-        #
-        #     counter = len(files)
-        #     for i in range(1, len(files) + 1):
-        #         os.rename("original{}.png".format(zeros(i)), "frame{}.png".format(zeros(counter)))
-        #         counter -= 1
-        #
-        #     # Statistics
-        #     for i in os.walk("."):
-        #         files = i[2]
-        #         break
-
-        os.remove(in_file)
-
-    if os.path.getsize(params['output_file']) <= (48 if output == consts.MP4 else 632):
-        return [os.path.getsize(params['output_file']), output]
+        codec = ["-c:v", "libvpx", "-crf", "8", "-b:v", "1500K"]
+    else:
+        codec = []
+
+    output_file = folder / f"temp.{output}"
+
+    with process_path(mp4, "source." + format) as path:
+        if not _reverse_segmented(path, folder, output_file, codec, audio, format, output):
+            print("Reversing in segments didn't work, reversing the whole video")
+            _reverse_whole(path, output_file, codec, audio)
+
+    # A blank mp4 is 48 bytes, a blank webm is ~632 bytes
+    if not output_file.exists() or os.path.getsize(output_file) <= (48 if output == consts.MP4 else 632):
+        return [os.path.getsize(output_file) if output_file.exists() else 0, output]
     else:
-        return open(params['output_file'], "rb")
+        return open(output_file, "rb")
@@ -0,0 +1,161 @@
+import os
+import platform
+import subprocess
+import time
+from pathlib import Path
+from typing import Optional, List
+
+from vredditshare.core import constants as consts
+from vredditshare.core.credentials import CredentialsLoader
+from vredditshare.hosts import GifFile, GifHost, FileEstimate, Gif
+from vredditshare.utils.media_buffer import MediaBuffer
+from vredditshare.utils.process_file import process_path
+from vredditshare.utils.temp_folder import TempFolder
+
+"""Re-encodes videos that are too big for every host so they fit under one of them. The bitrate comes from the
+host's size limit and the video's duration, and the resolution drops as the bitrate does so the picture doesn't
+turn to mush. Encodes are two pass so the size lands just under the limit.
+
+transcode_min_bitrate (kbps) in the general section of the credentials file is the lowest video bitrate worth
+uploading, anything that would need less than that is left as a failure"""
+
+MIN_VIDEO_BITRATE = int(CredentialsLoader.get_credentials()['general'].get('transcode_min_bitrate', 250))
+AUDIO_BITRATE = 128
+# Aim a little under the limit for the container overhead and the encoder missing its target
+SIZE_MARGIN = 0.95
+# Tallest resolution that still looks alright at a video bitrate (kbps), best first
+RESOLUTION_LADDER = ((4000, 1080), (2000, 720), (1000, 480), (500, 360), (0, 240))
+
+if platform.system() == 'Windows':
+    ffmpeg = 'ffmpeg.exe'
+else:
+    ffmpeg = 'ffmpeg'
+
+
+class TranscodePlan:
+    def __init__(self, host, video_bitrate, audio_bitrate, height):
+        self.host = host
+        # kbps
+        self.video_bitrate = video_bitrate
+        self.audio_bitrate = audio_bitrate
+        # None keeps the original height
+        self.height = height
+
+    def __repr__(self):
+        return f"TranscodePlan({self.host.name}, {self.video_bitrate}kbps video, {self.audio_bitrate}kbps audio, " \
+               f"{self.height or 'original '}p)"
+
+
+def plan(host, duration, audio=False, height=None, size_limit=None) -> Optional[TranscodePlan]:
+    """Work out the bitrates and resolution that fit a video of duration seconds under a host's size limit (MB).
+    height is the video's current height, it's never scaled up. None if the bitrate would be too low to bother"""
+    size_limit = size_limit or host.vid_size_limit
+    if not size_limit or not duration:
+        return None
+    audio_bitrate = AUDIO_BITRATE if audio else 0
+    video_bitrate = int(size_limit * SIZE_MARGIN * 8000 / duration) - audio_bitrate
+    if video_bitrate < MIN_VIDEO_BITRATE:
+        return None
+    target_height = next(h for bitrate, h in RESOLUTION_LADDER if video_bitrate >= bitrate)
+    if height and height <= target_height:
+        target_height = None
+    return TranscodePlan(host, video_bitrate, audio_bitrate, target_height)
+
+
+def _target_host(ghm, gif: Gif, gif_file) -> Optional[GifHost]:
+    """The first host that would take this video if it were small enough. gif_file can be a GifFile or a
+    FileEstimate"""
+    estimate = FileEstimate(gif_file.type, None, gif_file.duration, gif_file.audio, host=gif_file.host)
+    for option in ghm.get_upload_host(gif, file=estimate):
+        for host in option['hosts']:
+            if host.vid_size_limit:
+                return host
+    return None
+
+
+def could_fit(ghm, gif: Gif, estimate: FileEstimate) -> bool:
+    """Whether a video that's too big for every host could be transcoded to fit one, going off what it should look
+    like before it's downloaded. Without a duration only the host's other limits can be checked"""
+    if estimate.type == consts.GIF:
+        return False
+    host = _target_host(ghm, gif, estimate)
+    if host is None:
+        return False
+    return estimate.duration is None or plan(host, estimate.duration, estimate.audio) is not None
+
+
+def _run(command):
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+    return p.returncode == 0, output.decode(errors="replace")
+
+
+def encode(in_path, folder: Path, transcode_plan: TranscodePlan) -> Optional[MediaBuffer]:
+    """Two pass x264 encode of a video to the plan's bitrate"""
+    video = ["-c:v", "libx264", "-preset", "veryfast", "-b:v", f"{transcode_plan.video_bitrate}k",
+             "-maxrate", f"{int(transcode_plan.video_bitrate * 1.5)}k",
+             "-bufsize", f"{transcode_plan.video_bitrate * 2}k", "-pix_fmt", "yuv420p",
+             "-passlogfile", str(folder / "pass")]
+    if transcode_plan.height:
+        video += ["-vf", f"scale=-2:{transcode_plan.height}"]
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-y", "-i", in_path] + video +
+                        ["-pass", "1", "-an", "-f", "null", os.devnull])
+    if not ok:
+        print("First pass failed", response)
+        return None
+    audio = ["-c:a", "aac", "-b:a", f"{transcode_plan.audio_bitrate}k"] if transcode_plan.audio_bitrate else ["-an"]
+    output = MediaBuffer(prefix="transcode")
+    ok, response = _run([ffmpeg, "-loglevel", "error", "-y", "-i", in_path] + video + ["-pass", "2"] + audio +
+                        ["-movflags", "+faststart", "-f", "mp4", output.target()])
+    if not ok:
+        print("Second pass failed", response)
+        output.close()
+        return None
+    output.seek(0)
+    return output
+
+
+def transcode(ghm, gif: Gif, gif_file: GifFile) -> Optional[GifFile]:
+    """Re-encode a video so it fits under the size limit of a host that would otherwise take it. None if there is no
+    such host or it can't be made small enough"""
+    if gif_file.type == consts.GIF or not gif_file.duration:
+        return None
+    host = _target_host(ghm, gif, gif_file)
+    if host is None:
+        return None
+    dimensions = gif_file.info.dimensions
+    size_limit = host.vid_size_limit
+    # If the encoder overshoots, try again once with the bitrate scaled down by how much it missed by
+    for i in range(2):
+        transcode_plan = plan(host, gif_file.duration, gif_file.audio, dimensions[1] if dimensions else None,
+                              size_limit)
+        if transcode_plan is None:
+            print("Can't fit {}s into {}MB on {}".format(gif_file.duration, host.vid_size_limit, host.name))
+            return None
+        print("Transcoding", transcode_plan)
+        start = time.time()
+        with TempFolder("transcode") as folder, process_path(gif_file.file, "transcode") as in_path:
+            output = encode(in_path, folder, transcode_plan)
+        if output is None:
+            return None
+        size = len(output) / 1000000
+        print(f"Transcoded {gif_file.size}MB to {size}MB in {round(time.time() - start, 2)}s")
+        if size <= host.vid_size_limit:
+            return GifFile(output, gif_file.host, consts.MP4, size=size, duration=gif_file.duration,
+                           audio=gif_file.audio)
+        output.close()
+        size_limit = size_limit * host.vid_size_limit / size
+    return None
+
+
+def fit_to_host(ghm, gif: Gif) -> List[dict]:
+    """Upload options like GifHostManager.get_upload_host gives, for transcoded versions of the gif's videos"""
+    for gif_file in gif.files:
+        new_file = transcode(ghm, gif, gif_file)
+        if new_file is None:
+            continue
+        options = ghm.get_upload_host(gif, file=new_file)
+        if options:
+            return options
+        new_file.close()
+    return []
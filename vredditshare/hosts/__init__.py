@@ -1,9 +1,7 @@
 import os
-import requests
-from io import BytesIO
 from vredditshare.core import constants as consts
-from vredditshare.core.file import get_frames, get_duration, has_audio, MediaInfo, estimate_frames_to_pngs
-from typing import TYPE_CHECKING
+from vredditshare.core.file import MediaInfo, estimate_frames_to_pngs
+from typing import TYPE_CHECKING, Optional, List
 if TYPE_CHECKING:
     from vredditshare.core.gif import GifHostManager
 
@@ -28,14 +26,15 @@ ONLY_NSFW = 3
 
 
 class GifFile:
-    def __init__(self, file, host=None, gif_type=None, size=None, duration=None, frames=0, audio=None, conversion=None):
+    def __init__(self, file, host=None, gif_type=None, size=None, duration=None, frames=0, audio=None, conversion=None,
+                 info=None):
         self.file = file
-        self.info = MediaInfo(self.file)
+        # All of the metadata comes from one probe. Files that share the same bytes can share the info too
+        self.info = info if info else MediaInfo(self.file)
         self.file.seek(0)
         self.type = gif_type
         self.size = None
-        self.frames = frames
-        # Make unified metadata grabber function
+        self._frames = frames
 
         if audio is None:
             self.audio = False
@@ -43,24 +42,20 @@ class GifFile:
             if audio:
                 self.audio = True
             else:
-                self.audio = has_audio(self.file)
-        if gif_type == consts.GIF and not frames:
-            self.frames = get_frames(self.file)
-            if self.frames == 0:
-                if self.info.frame_count:
-                    self.frames = self.info.frame_count
+                self.audio = self.info.has_audio
         if size:
             self.size = size
         else:
-            if isinstance(file, BytesIO):
-                self.size = file.getbuffer().nbytes / 1000000
+            if hasattr(file, "getbuffer"):     # BytesIO and MediaBuffer
+                with file.getbuffer() as buffer:
+                    self.size = buffer.nbytes / 1000000
             else:
                 self.size = os.fstat(file.fileno()).st_size / 1000000  # Convert to MB
 
         if duration:
             self.duration = duration
         else:
-            self.duration = get_duration(self.file)
+            self.duration = self.info.duration
 
         self.conversion = conversion
         if self.conversion:
@@ -70,6 +65,13 @@ class GifFile:
 
         self.host = host
 
+    @property
+    def frames(self):
+        """Frame count, only worked out when something actually needs it since it can mean decoding the file"""
+        if not self._frames:
+            self._frames = self.info.frame_count or 0
+        return self._frames
+
     def close(self):
         self.file.close()
 
@@ -77,6 +79,22 @@ class GifFile:
         self.close()
 
 
+class FileEstimate:
+    """What a file should look like before it's downloaded. Has the same fields GifHostManager looks at on a GifFile
+    so host limits can be checked without the file"""
+    def __init__(self, gif_type, size, duration, audio=False, frames=0, host=None):
+        self.type = gif_type
+        # In MB. Size and duration can be None if they aren't known, then they aren't checked
+        self.size = size
+        self.duration = duration
+        self.audio = audio
+        self.frames = frames
+        self.host = host
+
+    def __repr__(self):
+        return f"FileEstimate({self.type}, {self.size}MB, {self.duration}s, audio={self.audio})"
+
+
 class Gif:
     process_id = False
 
@@ -119,6 +137,11 @@ class Gif:
         """Analyze how to (and if possible to) download gif"""
         raise NotImplementedError
 
+    def estimate(self) -> Optional[List[FileEstimate]]:
+        """What the files should look like going off what the host tells us, without downloading them. None if we
+        can't tell, then the files just get checked after they're downloaded"""
+        return None
+
 
     # def download(self) -> list:
     #     return self.files
@@ -178,22 +201,3 @@ class GifHost:
 
     def __str__(self):
         return self.name
-
-
-def get_response_size(url, max=None):
-    """Returns size in MB"""
-    if max:
-        max_bytes = max * 1000000
-    size = 0
-    headers = {"User-Agent": consts.spoof_user_agent}
-    try:
-        with requests.get(url, stream=True, headers=headers) as r:
-            for chunk in r.iter_content(8196):
-                size += len(chunk)
-                if max:
-                    if size > max_bytes:
-                        return False
-        return size / 1000000
-    except Exception as e:
-        print(e, dir(e))
-        raise e
\ No newline at end of file
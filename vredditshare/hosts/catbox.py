@@ -1,12 +1,13 @@
-import requests
+from requests import RequestException
 from requests_toolbelt import MultipartEncoder
 import re
-from io import BytesIO
 
-from vredditshare.hosts import GifFile, Gif, GifHost
+from vredditshare.hosts import UploadFailed, GifFile, FileEstimate, Gif, GifHost
 from vredditshare.core.credentials import CredentialsLoader
 from vredditshare.core import constants as consts
-from vredditshare.core.file import is_valid
+from vredditshare.core.file import MediaInfo
+from vredditshare.utils import downloader
+from vredditshare.utils.http import Sessions
 
 catbox_hash = CredentialsLoader.get_credentials()['catbox']['hash']
 
@@ -25,14 +26,24 @@ class CatboxGif(Gif):
             return id
         return None
 
+    def estimate(self):
+        size = downloader.content_length(self.url, Sessions.get("catbox"))
+        if size is None:
+            return None
+        # Catbox files are offered both as a gif and as whatever they are
+        return [FileEstimate(consts.GIF, size / 1000000, None, host=self.host),
+                FileEstimate(self.id.split(".")[-1], size / 1000000, None, host=self.host)]
+
     def analyze(self):
-        r = requests.get(self.url)
-        file = BytesIO(r.content)
-        if not is_valid(file):
+        file = downloader.download(self.url, session=Sessions.get("catbox"))
+        if not file:
+            return False
+        info = MediaInfo(file)
+        if not info.valid:
             return False
-        gif_file = GifFile(file, self.host, consts.GIF)
+        gif_file = GifFile(file, self.host, consts.GIF, info=info)
         self.files.append(gif_file)
-        vid_file = GifFile(file, self.host, self.id.split(".")[-1], audio=False)
+        vid_file = GifFile(file, self.host, self.id.split(".")[-1], audio=False, info=info)
         if self.id[-3:] == consts.GIF:
             self.files.append(vid_file)
         else:
@@ -58,8 +69,13 @@ class CatboxHost(GifHost):
         files = {'reqtype': 'fileupload', 'userhash': catbox_hash, 'fileToUpload': ("file.{}".format(gif_type),
                                                                                      file, mimetype)}
         m = MultipartEncoder(fields=files)
-        r = requests.post("https://catbox.moe/user/api.php", data=m, headers={'Content-Type': m.content_type,
-                                                                              'User-Agent': consts.user_agent})
+        try:
+            r = Sessions.get("catbox").post("https://catbox.moe/user/api.php", data=m,
+                                            headers={'Content-Type': m.content_type, 'User-Agent': consts.user_agent},
+                                            timeout=Sessions.upload_timeout())
+        except RequestException as e:
+            print("Catbox upload failed", e)
+            return UploadFailed
         if r.status_code == 200:
             if r.text == "Down for maintainence...":
                 return None
@@ -73,8 +89,9 @@ class CatboxHost(GifHost):
         if isinstance(gif, Gif):
             gif = [gif]
         print(" ".join([g.id for g in gif]))
-        r = requests.post("https://catbox.moe/user/api.php", data={'reqtype': 'deletefiles', 'userhash': catbox_hash,
-                                                                   'files': " ".join([g.id for g in gif])})
+        r = Sessions.get("catbox").post("https://catbox.moe/user/api.php",
+                                        data={'reqtype': 'deletefiles', 'userhash': catbox_hash,
+                                              'files': " ".join([g.id for g in gif])})
         print(r.content)
         return True
 
@@ -4,11 +4,12 @@ from requests_toolbelt.multipart.encoder import MultipartEncoder
 import time
 import re
 from math import ceil
-from io import BytesIO
 
 from vredditshare.core.credentials import CredentialsLoader
 from vredditshare.core import constants as consts
-from vredditshare.hosts import NO_NSFW, GifFile, Gif, GifHost
+from vredditshare.hosts import NO_NSFW, UploadFailed, GifFile, FileEstimate, Gif, GifHost
+from vredditshare.utils import downloader
+from vredditshare.utils.http import Sessions
 
 ENCODE_TIMEOUT = 3200
 WAIT = 8
@@ -82,7 +83,7 @@ class GfycatClient:
                     "client_secret": self.gfysecret}
 
         url = self.TOKEN_URL
-        r = requests.post(url, data=str(data), headers={'User-Agent': consts.user_agent})
+        r = Sessions.get("gfycat").post(url, data=str(data), headers={'User-Agent': consts.user_agent})
         try:
             response = r.json()
         except json.decoder.JSONDecodeError as e:
@@ -106,7 +107,7 @@ class GfycatClient:
                     "client_secret": self.gfysecret, "refresh_token": self.refresh}
             url = self.TOKEN_URL
             # For some dumb reason, data has to be a string
-            r = requests.post(url, data=str(data), headers={'User-Agent': consts.user_agent})
+            r = Sessions.get("gfycat").post(url, data=str(data), headers={'User-Agent': consts.user_agent})
             try:
                 response = r.json()
             except json.decoder.JSONDecodeError as e:
@@ -124,7 +125,11 @@ class GfycatClient:
     def get_gfycat(self, id):
         headers = {"Authorization": "Bearer {}".format(self.get_token())}
         url = self.GFYCAT_INFO.format(id)
-        r = requests.get(url, headers=headers)
+        try:
+            r = Sessions.get("gfycat").get(url, headers=headers)
+        except requests.RequestException as e:
+            print("Gfycat - couldn't get info", e)
+            return None
         if r.status_code != 200:
             print("Gfycat - get problem status code {}".format(str(r.status_code)))
             return None
@@ -152,7 +157,7 @@ class GfycatClient:
             if noMd5:
                 params['noMd5'] = True
             print("getting gfyname...", params)
-            r = requests.post(url, headers=headers, data=str(params))
+            r = Sessions.get("gfycat").post(url, headers=headers, data=str(params))
             # print(r.text)
             try:
                 metadata = r.json()
@@ -164,7 +169,7 @@ class GfycatClient:
                     if tries:
                         if media_type != consts.LINK:
                             filestream.seek(0)
-                        time.sleep(5)
+                        time.sleep(Sessions.backoff(4 - tries))
                         continue
                     else:
                         break
@@ -179,7 +184,7 @@ class GfycatClient:
                 if tries:
                     if media_type != consts.LINK:
                         filestream.seek(0)
-                    time.sleep(5)
+                    time.sleep(Sessions.backoff(4 - tries))
                     continue
                 else:
                     break
@@ -193,13 +198,15 @@ class GfycatClient:
                     files = {"key": metadata["gfyname"], "file": (metadata["gfyname"], filestream, "image/gif")}
                 m = MultipartEncoder(fields=files)
                 print("uploading to gfyid {}...".format(metadata['gfyname']))
-                r = requests.post(url, data=m, headers={'Content-Type': m.content_type, 'User-Agent': consts.user_agent})
+                r = Sessions.get("gfycat").post(url, data=m, headers={'Content-Type': m.content_type,
+                                                                       'User-Agent': consts.user_agent},
+                                                timeout=Sessions.upload_timeout())
 
             # check status for gif's id
             url = self.GFYCAT_STATUS.format(metadata["gfyname"])
             headers = {'User-Agent': consts.user_agent}
             print("waiting for encode...", end=" ")
-            r = requests.get(url, headers=headers)
+            r = Sessions.get("gfycat").get(url, headers=headers)
             try:
                 ticket = r.json()
             except json.decoder.JSONDecodeError as e:
@@ -212,7 +219,7 @@ class GfycatClient:
                 print(ticket)
                 if ticket.get("task", None) == "encoding":
                     time.sleep(WAIT)
-                    r = requests.get(url, headers=headers)
+                    r = Sessions.get("gfycat").get(url, headers=headers)
                     try:
                         ticket = r.json()
                     except json.decoder.JSONDecodeError as e:
@@ -225,7 +232,7 @@ class GfycatClient:
                 elif ticket.get("task", None) == 'NotFoundo':
                     print("notfoundo", end=" ")
                     time.sleep(WAIT * 2)
-                    r = requests.get(url, headers=headers)
+                    r = Sessions.get("gfycat").get(url, headers=headers)
                     ticket = r.json()
                     # print(ticket)
                     if float(ticket.get('progress', 0)) > percentage:
@@ -242,7 +249,7 @@ class GfycatClient:
                     if tries:
                         if media_type != consts.LINK:
                             filestream.seek(0)
-                        time.sleep(5)
+                        time.sleep(Sessions.backoff(4 - tries))
                         continue
                     else:
                         break
@@ -253,7 +260,7 @@ class GfycatClient:
                     if tries:
                         if media_type != consts.LINK:
                             filestream.seek(0)
-                        time.sleep(5)
+                        time.sleep(Sessions.backoff(4 - tries))
                         continue
                     else:
                         break
@@ -270,7 +277,7 @@ class GfycatClient:
                 if tries:
                     if media_type != consts.LINK:
                         filestream.seek(0)
-                    time.sleep(5)
+                    time.sleep(Sessions.backoff(4 - tries))
                     continue
                 else:
                     break
@@ -283,8 +290,17 @@ class GfycatClient:
 
 
 class GfycatGif(Gif):
-    def analyze(self) -> bool:
+    def estimate(self):
         self.pic = self.host.API.get_gfycat(self.id)
+        if not self.pic or not self.pic.get('webmSize', None) or not self.pic.get('frameRate', None):
+            return None
+        return [FileEstimate(consts.WEBM, self.pic['webmSize'] / 1000000,
+                             self.pic['numFrames'] / self.pic['frameRate'], audio=self.pic['hasAudio'],
+                             host=self.host)]
+
+    def analyze(self) -> bool:
+        if not self.pic:
+            self.pic = self.host.API.get_gfycat(self.id)
         if not self.pic:
             return False
         try:
@@ -301,14 +317,18 @@ class GfycatGif(Gif):
         self.duration = self.pic['numFrames'] / self.pic['frameRate']
         audio = self.pic['hasAudio']
         frames = self.pic['numFrames']
-        self.file = BytesIO(requests.get(self.url).content)
+        self.file = downloader.download(self.url, session=Sessions.get("gfycat"))
+        if not self.file:
+            return False
         if int(self.pic['nsfw']):
             print("{} says it's nsfw".format(self.host.name))
             # pprint(self.pic)
         # self.nsfw = self.nsfw or int(self.pic['nsfw']) # Gfycat's NSFW flag is essentially useless
         self.size = self.pic['webmSize'] / 1000000
-        self.files.append(GifFile(self.file, self.host, self.type, self.size, self.duration, audio=audio))
-        self.files.append(GifFile(self.file, self.host, consts.GIF, self.size, self.duration, frames, audio=audio))
+        vid_file = GifFile(self.file, self.host, self.type, self.size, self.duration, audio=audio)
+        self.files.append(vid_file)
+        self.files.append(GifFile(self.file, self.host, consts.GIF, self.size, self.duration, frames, audio=audio,
+                                  info=vid_file.info))
         return True
 
 
@@ -327,7 +347,11 @@ class GfycatHost(GifHost):
 
     @classmethod
     def upload(cls, file, gif_type, nsfw, audio=False):
-        id = cls.API.upload(file, gif_type, nsfw=nsfw, audio=audio)
+        try:
+            id = cls.API.upload(file, gif_type, nsfw=nsfw, audio=audio)
+        except requests.RequestException as e:
+            print("Gfycat upload failed", e)
+            return UploadFailed
         if id:
             return cls.gif_type(cls, id, nsfw=nsfw)
 
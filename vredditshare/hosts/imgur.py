@@ -4,13 +4,13 @@ import time
 import requests
 import json
 import re
-from io import BytesIO
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
 from vredditshare.core.credentials import CredentialsLoader
 from vredditshare.core import constants as consts
-from vredditshare.hosts import UploadFailed, GifFile, Gif, GifHost
-from vredditshare.core.file import get_duration, is_valid
+from vredditshare.hosts import UploadFailed, GifFile, FileEstimate, Gif, GifHost
+from vredditshare.utils import downloader
+from vredditshare.utils.http import Sessions
 
 
 class InvalidRefreshToken(Exception):
@@ -83,7 +83,8 @@ class ImgurClient:
             data = {"grant_type": "refresh_token", "client_id": self.client_id,
                     "client_secret": self.client_secret, "refresh_token": self.refresh}
             # For some dumb reason, data has to be a string
-            r = requests.post(self.OAUTH_BASE + self.TOKEN_URL, data=data, headers={'User-Agent': consts.user_agent})
+            r = Sessions.get("imgur").post(self.OAUTH_BASE + self.TOKEN_URL, data=data,
+                                           headers={'User-Agent': consts.user_agent})
             try:
                 response = r.json()
             except json.decoder.JSONDecodeError as e:
@@ -103,7 +104,7 @@ class ImgurClient:
     def get_request(self, url, params=None):
         # headers = {'Authorization': "Bearer " + self.get_token()}
         headers = {'Authorization': "Client-ID " + self.client_id}
-        r = requests.get(self.API_BASE + url, headers=headers, params=params)
+        r = Sessions.get("imgur").get(self.API_BASE + url, headers=headers, params=params)
         if r.status_code != 200:
             try:
                 errors = r.json()
@@ -118,7 +119,8 @@ class ImgurClient:
         if headers:
             full_headers = {**full_headers, **headers}
         try:
-            r = requests.post(self.API_BASE + url, headers=full_headers, data=data, params=params)
+            r = Sessions.get("imgur").post(self.API_BASE + url, headers=full_headers, data=data, params=params,
+                                           timeout=Sessions.upload_timeout())
         except Exception as e:
             print(self.API_BASE + url, full_headers, data, params)
             # print(r, r.content)
@@ -137,7 +139,7 @@ class ImgurClient:
         full_headers = {'Authorization': "Client-ID " + self.client_id}
         if headers:
             full_headers = {**full_headers, **headers}
-        r = requests.options(self.API_BASE + url, headers=full_headers)
+        r = Sessions.get("imgur").options(self.API_BASE + url, headers=full_headers)
         if r.status_code != 200:
             raise ImgurFailedRequest
         return r
@@ -161,11 +163,11 @@ class ImgurClient:
                 response = self._upload_image(file, media_type, nsfw, audio)
                 if isinstance(response, str):
                     return response
-                time.sleep(5)
+                time.sleep(Sessions.backoff(i))
             return UploadFailed
-        except requests.ConnectionError as e:
+        except requests.RequestException as e:
             print(e, traceback.format_exc())
-            raise e
+            return UploadFailed
 
     def _upload_image(self, file, media_type, nsfw, audio=False):
         file.seek(0)
@@ -188,14 +190,15 @@ class ImgurClient:
         # We get around the image file size restriction by using a client ID made by a browser
         # Luckily the API is similarish (rather than last time when it wasn't and also 3 steps)
         elif media_type == consts.GIF:
-            s = requests.Session()
+            s = Sessions.get("imgur-web")
             api = self.IMAGE_UPLOAD
             params = {'client_id': CredentialsLoader.get_credentials()[self.CREDENTIALS_BLOCK]['imgur_web_id']}
             r = s.options(self.API_BASE + api, params=params)
             data['image'] = (file.name, file, "image/gif")
             data['name'] = file.name
             m = MultipartEncoder(fields=data)
-            r = s.post(self.API_BASE + api, headers={'Content-Type': m.content_type}, data=m, params=params)
+            r = s.post(self.API_BASE + api, headers={'Content-Type': m.content_type}, data=m, params=params,
+                       timeout=Sessions.upload_timeout())
         # pprint(r.json())
         try:
             j = r.json()
@@ -257,6 +260,14 @@ class ImgurGif(Gif):
 
         return id
 
+    def estimate(self):
+        if not self.pic or not self.pic['animated'] or not self.pic.get('mp4_size', None):
+            return None
+        estimates = [FileEstimate(consts.MP4, self.pic['mp4_size'] / 1000000, None, host=self.host)]
+        if self.pic['type'] == 'image/gif' and self.pic.get('size', None):
+            estimates.append(FileEstimate(consts.GIF, self.pic['size'] / 1000000, None, host=self.host))
+        return estimates
+
     def analyze(self) -> bool:
         """Analyze an imgur gif and determine how to reverse and upload"""
 
@@ -267,19 +278,19 @@ class ImgurGif(Gif):
         if not self.pic['animated']:
             print("Not a gif!")
             return False
-        r = requests.get(self.pic['mp4'])
-        file = BytesIO(r.content)
-        self.duration = get_duration(file)
+        file = downloader.download(self.pic['mp4'], session=Sessions.get("imgur"))
+        if not file:
+            return False
+        vid_file = GifFile(file, host=self.host, gif_type=consts.MP4, size=self.pic['mp4_size']/1000000)
+        self.duration = vid_file.duration
 
-        self.files.append(GifFile(file, host=self.host, gif_type=consts.MP4, duration=self.duration,
-                                  size=self.pic['mp4_size']/1000000))
+        self.files.append(vid_file)
 
         # If the file type is a gif, add it as an option and prioritize it
         if self.pic['type'] == 'image/gif':
-            r = requests.get(self.pic['gifv'][:-1])
-            gif = BytesIO(r.content)
-            if is_valid(gif):
-                gif_file = GifFile(gif, host=self.host, gif_type=consts.GIF, duration=self.duration)
+            gif = downloader.download(self.pic['gifv'][:-1], session=Sessions.get("imgur"))
+            gif_file = GifFile(gif, host=self.host, gif_type=consts.GIF, duration=self.duration) if gif else None
+            if gif_file and gif_file.info.valid:
             # else:
             #     gif_file = GifFile(file, host=self.host, gif_type=consts.GIF, duration=self.duration)
                 print("added gif file")
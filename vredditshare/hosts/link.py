@@ -1,34 +1,65 @@
 import requests
-import time
 import re
-from io import BytesIO
 
-from vredditshare.hosts import GifFile, Gif, GifHost, get_response_size
+from vredditshare.hosts import GifFile, FileEstimate, Gif, GifHost
 from vredditshare.core import constants as consts
+from vredditshare.utils.media_buffer import MediaBuffer, CHUNK_SIZE
+from vredditshare.utils.http import Sessions
+from vredditshare.utils import downloader
+
+
+# Biggest gif we'll download, in MB
+MAX_SIZE = 400
 
 
 class LinkGif(Gif):
+    def estimate(self):
+        size = downloader.content_length(self.url, Sessions.get("link"),
+                                         headers={"User-Agent": consts.spoof_user_agent})
+        if size is None:
+            return None
+        return [FileEstimate(consts.GIF, size / 1000000, None, host=self.host)]
+
     def analyze(self) -> bool:
-        # Safely download the gif to determine if it
-        self.size = get_response_size(self.url, 400)
-        if not self.size:
-            return False
-        # Is it a gif?
+        # Download it once, bailing out as soon as it's clearly not a gif or too big
         headers = {"User-Agent": consts.spoof_user_agent}
+        file = None
         try:
-            r = requests.get(self.url, headers=headers)
-        except ConnectionError as e:
-            print("got rejected, waiting for a second")
-            time.sleep(15)
-            r = requests.get(self.url, headers=headers)
-        if r.status_code != requests.codes.ok:
-            print("Got an error code for gif", r.status_code)
+            r = Sessions.get("link").get(self.url, headers=headers, stream=True)
+            with r:
+                if r.status_code != requests.codes.ok:
+                    print("Got an error code for gif", r.status_code)
+                    return False
+                length = r.headers.get("Content-Length", "")
+                if length.isdigit() and int(length) > MAX_SIZE * 1000000:
+                    print("Gif is too big", int(length) / 1000000)
+                    return False
+                file = MediaBuffer(prefix="linkgif")
+                header = b""
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    # Is it a gif?
+                    if len(header) < 3:
+                        header += chunk[:3 - len(header)]
+                        if len(header) == 3 and header != b'GIF':
+                            file.close()
+                            return None
+                    file.write(chunk)
+                    if file.tell() > MAX_SIZE * 1000000:
+                        print("Gif went over", MAX_SIZE, "MB")
+                        file.close()
+                        return False
+        except requests.RequestException as e:
+            print("Couldn't download gif", e)
+            if file is not None:
+                file.close()
             return False
-        header = r.content[:3]
         if header != b'GIF':
+            file.close()
             return None
+        file.seek(0)
         self.type = consts.GIF
-        self.file = BytesIO(r.content)
+        self.file = file
+        self.size = len(file) / 1000000
         self.files.append(GifFile(self.file, self.host, self.type, self.size, self.duration))
         return True
 
@@ -1,73 +1,184 @@
-import requests
 import re
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from prawcore.exceptions import ResponseException
+from requests import RequestException
 
 from vredditshare.core import constants as consts
-from vredditshare.hosts import GifFile, Gif, GifHost
+from vredditshare.hosts import GifFile, FileEstimate, Gif, GifHost
 from vredditshare.core.concat import concat
+from vredditshare.core.reddit_cache import get_submission, find_video_submission
+from vredditshare.utils import downloader
+from vredditshare.utils.http import Sessions
+from vredditshare.utils.dash_manifest import Manifest, ManifestParseError, parse_manifest
 
 REDDIT_SUBMISSION = re.compile("http(?:s)?://(?:\w+?\.)?reddit.com(/r/|/user/)?(?(1)(\w{2,21}))(/comments/)?(?(3)(\w{5,7})(?:/[\w%\\\\-]+)?)?(?(4)/(\w{7}))?/?(\?)?(?(6)(\S+))?")
 
 
-class RedditVid(Gif):
-    def analyze(self) -> bool:
-        headers = {"User-Agent": consts.spoof_user_agent}
-        r = requests.get("https://v.redd.it/{}".format(self.id), headers=headers)
-        if r.status_code == 404:
-            print("Reddit returned a 404 for this video")
-            return False
+# Audio could be in either place
+AUDIO_URLS = ("https://v.redd.it/{}/DASH_audio.mp4", "https://v.redd.it/{}/audio")
 
-        submission_regex = REDDIT_SUBMISSION.findall(r.url)
-        url = None
-        audio = False
+# Declared bandwidths are averages, leave some room for the container and bursts
+SIZE_MARGIN = 1.1
 
-        if not submission_regex:
-            print("Deleted?")
-            return False
+# For downloading a video's tracks side by side
+fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="reddit-fetch")
+
+
+def download(url, headers=None):
+    """Download into a MediaBuffer, None if Reddit doesn't give it to us"""
+    return downloader.download(url, session=Sessions.get("reddit"), headers=headers)
+
+
+def find_audio(video_id, headers=None):
+    """Check which of the audio URLs exists without downloading it"""
+    for audio_url in AUDIO_URLS:
+        url = audio_url.format(video_id)
+        try:
+            r = Sessions.get("reddit").head(url, headers=headers, allow_redirects=True)
+        except RequestException as e:
+            print("Couldn't check for audio at", url, e)
+            continue
+        if r.status_code == 200:
+            return url
+    return None
+
+
+def get_manifest(url, headers=None):
+    """Get the renditions in a video's DASH manifest, None if we couldn't"""
+    try:
+        r = Sessions.get("reddit").get(url, headers=headers)
+    except RequestException as e:
+        print("Couldn't get DASH manifest", e)
+        return None
+    if r.status_code != 200:
+        print("Getting DASH manifest returned status", r.status_code)
+        return None
+    try:
+        return parse_manifest(r.text, url)
+    except ManifestParseError as e:
+        print("Couldn't read DASH manifest", e)
+        return None
+
+
+def download_audio(video_id, headers=None):
+    url = find_audio(video_id, headers)
+    if url:
+        return download(url, headers)
+    return None
+
+
+class RedditVid(Gif):
+    _reddit_video = None
+
+    def get_reddit_video(self):
+        """The submission's reddit_video info, empty if the video is gone or unusable. Only looked up once"""
+        if self._reddit_video is None:
+            self._reddit_video = self._find_reddit_video() or {}
+        return self._reddit_video
 
-        submission_id = submission_regex[0][3]
-        submission = self.host.ghm.reddit.submission(submission_id)
+    def _find_reddit_video(self):
+        headers = {"User-Agent": consts.spoof_user_agent}
         try:
+            # If we already came across the submission for this video, we don't need to look it up again
+            submission = find_video_submission(self.id)
+            if not submission:
+                r = Sessions.get("reddit").get("https://v.redd.it/{}".format(self.id), headers=headers)
+                if r.status_code == 404:
+                    print("Reddit returned a 404 for this video")
+                    return None
+
+                submission_regex = REDDIT_SUBMISSION.findall(r.url)
+
+                if not submission_regex:
+                    print("Deleted?")
+                    return None
+
+                submission_id = submission_regex[0][3]
+                submission = get_submission(self.host.ghm.reddit, submission_id)
             if not submission.is_video:
                 print("Reddit submission is not marked as a video.")
-                return False
+                return None
             if not submission.media:
                 print("Submission is video but there is no media data")
-                return False
-            if submission.media['reddit_video'].get('fallback_url', None):
-                url = submission.media['reddit_video']['fallback_url']
-            elif submission.media['reddit_video'].get("transcoding_status", None) == "error":
+                return None
+            reddit_video = submission.media['reddit_video']
+            if not reddit_video.get('fallback_url', None) and \
+                    reddit_video.get("transcoding_status", None) == "error":
                 print("Reddit had an error transcoding this video")
-                return False
+                return None
+            return reddit_video
         except ResponseException as e:
             print("Video is inaccessible, likely deleted")
-            return False
+            return None
 
-        r = requests.get(url)
-        if r.status_code != 200:
-            print("Getting Reddit Video returned status, deleted?", r.status_code)
-            return False
-        file = BytesIO(r.content)
+    def estimate(self):
+        reddit_video = self.get_reddit_video()
+        if not reddit_video or not reddit_video.get('duration', None):
+            return None
+        # Size is left out, a lower rendition can be picked if the full one is too big
+        return [FileEstimate(consts.MP4, None, reddit_video['duration'], host=self.host)]
 
-        r = requests.get("https://v.redd.it/{}/DASH_audio.mp4".format(self.id), headers=headers)
-        if r.status_code == 200:
-            file = concat(file, BytesIO(r.content))
-            audio = True
-
-        if not audio:
-            # Audio could be here instead
-            r = requests.get("https://v.redd.it/{}/audio".format(self.id), headers=headers)
-            if r.status_code == 200:
-                file = concat(file, BytesIO(r.content))
+    def analyze(self) -> bool:
+        headers = {"User-Agent": consts.spoof_user_agent}
+        audio = False
+
+        reddit_video = self.get_reddit_video()
+        if not reddit_video:
+            return False
+        url = reddit_video.get('fallback_url', None)
+
+        # Pick a rendition that some host will take, rather than always the biggest
+        manifest = None
+        if reddit_video.get('dash_url', None):
+            manifest = get_manifest(reddit_video['dash_url'], headers)
+        if manifest and manifest.videos:
+            duration = manifest.duration or reddit_video.get('duration', None)
+            rendition = self.choose_rendition(manifest, duration)
+            print("Chose rendition", rendition)
+            url = rendition.url
+            audio_url = manifest.audio.url if manifest.audio else None
+            # Video and audio download at the same time
+            video_download = fetch_pool.submit(download, url)
+            audio_download = fetch_pool.submit(download, audio_url) if audio_url else None
+        else:
+            video_download = fetch_pool.submit(download, url)
+            audio_download = fetch_pool.submit(download_audio, self.id, headers)
+        file = video_download.result()
+        audio_file = audio_download.result() if audio_download else None
+        if not file:
+            print("Couldn't get Reddit Video, deleted?")
+            if audio_file:
+                audio_file.close()
+            return False
+        if audio_file:
+            combined = concat(file, audio_file)
+            audio_file.close()
+            if combined:
+                file.close()
+                file = combined
                 audio = True
 
         self.type = consts.MP4
-        self.size = file.getbuffer().nbytes / 1000000
+        self.size = len(file) / 1000000
         self.files.append(GifFile(file, self.host, self.type, self.size, audio=audio))
         # self.files.append(GifFile(file, self.host, consts.GIF, self.size))
         return True
 
+    def choose_rendition(self, manifest: Manifest, duration):
+        """The highest quality video rendition that, with the audio, fits under an upload host's limits. Falls back
+        to the smallest one if none do"""
+        videos = manifest.videos
+        if not duration:
+            return videos[0]
+        audio = manifest.audio
+        audio_size = audio.estimated_size(duration) if audio else 0
+        for rendition in videos:
+            size = (rendition.estimated_size(duration) + audio_size) * SIZE_MARGIN / 1000000
+            estimate = FileEstimate(consts.MP4, size, duration, audio=audio is not None, host=self.host)
+            if self.host.ghm.get_upload_host(self, file=estimate):
+                return rendition
+        return videos[-1]
+
 
 class RedditVideoHost(GifHost):
     name = "RedditVideo"
@@ -85,9 +196,8 @@ class RedditVideoHost(GifHost):
             subregex = REDDIT_SUBMISSION.findall(text)
             if subregex:
                 if subregex[0][3]:
-                    reddit = cls.ghm.reddit
                     try:
-                        submission = reddit.submission(subregex[0][3])
+                        submission = get_submission(cls.ghm.reddit, subregex[0][3])
                         regex = cls.regex.findall(submission.url)
                     except ResponseException:
                         print("Submission does not exist")
@@ -118,10 +228,18 @@ class RedditVideoHost(GifHost):
         return len(cls.regex.findall(text)) != 0
 
 class RedditGif(Gif):
+    def estimate(self):
+        size = downloader.content_length(self.url, Sessions.get("reddit"))
+        if size is None:
+            return None
+        return [FileEstimate(consts.GIF, size / 1000000, None, host=self.host)]
+
     def analyze(self) -> bool:
         self.type = consts.GIF
-        self.file = BytesIO(requests.get(self.url).content)
-        self.size = self.file.getbuffer().nbytes / 1000000
+        self.file = downloader.download(self.url, session=Sessions.get("reddit"))
+        if not self.file:
+            return False
+        self.size = len(self.file) / 1000000
         self.files.append(GifFile(self.file, self.host, self.type, self.size))
         return True
 
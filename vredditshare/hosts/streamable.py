@@ -1,9 +1,10 @@
-import requests
 import re
-from io import BytesIO
+from requests import RequestException
 from vredditshare.core.credentials import CredentialsLoader
 from vredditshare.core import constants as consts
-from vredditshare.hosts import GifFile, Gif, GifHost
+from vredditshare.hosts import GifFile, FileEstimate, Gif, GifHost
+from vredditshare.utils import downloader
+from vredditshare.utils.http import Sessions
 
 
 class StreamableClient:
@@ -21,7 +22,12 @@ class StreamableClient:
         self.headers = {'User-Agent': consts.user_agent}
 
     def download_video(self, id):
-        r = requests.get('https://api.streamable.com/videos/{}'.format(id), headers=self.headers, auth=self.auth)
+        try:
+            r = Sessions.get("streamable").get('https://api.streamable.com/videos/{}'.format(id), headers=self.headers,
+                                                auth=self.auth)
+        except RequestException as e:
+            print("Couldn't get Streamable info", e)
+            return None
         if r.status_code == 404:
             return None
         json = r.json()
@@ -36,22 +42,44 @@ class StreamableClient:
             data = {'title': title}
         # m = MultipartEncoder(fields=files)
         print("Uploading to streamable...")
-        r = requests.post('https://api.streamable.com/upload', headers=self.headers, files=files, data=data, auth=self.auth)
+        try:
+            r = Sessions.get("streamable").post('https://api.streamable.com/upload', headers=self.headers, files=files,
+                                                 data=data, auth=self.auth, timeout=Sessions.upload_timeout())
+        except RequestException as e:
+            print("Streamable upload failed", e)
+            return None
         if r.text:
             return r.json()['shortcode']
 
     def upload_link(self, link, title):
-        r = requests.get('https://api.streamable.com/import', headers=self.headers, params={'url': link, 'title': title}, auth=self.auth)
+        r = Sessions.get("streamable").get('https://api.streamable.com/import', headers=self.headers,
+                                            params={'url': link, 'title': title}, auth=self.auth)
         print(r.text)
 
 streamable = StreamableClient()
 
 class StreamableGif(Gif):
+    _info = None
+
+    def get_info(self):
+        """Streamable's info on the mp4, only asked for once"""
+        if self._info is None:
+            self._info = streamable.download_video(self.id) or {}
+        return self._info
+
+    def estimate(self):
+        info = self.get_info()
+        if not info:
+            return None
+        return [FileEstimate(consts.MP4, info['size'] / 1000000, info['duration'], host=self.host)]
+
     def analyze(self):
-        info = streamable.download_video(self.id)
+        info = self.get_info()
         if not info:
             return False
-        file = BytesIO(requests.get(info['url']).content)
+        file = downloader.download(info['url'], session=Sessions.get("streamable"))
+        if not file:
+            return False
         self.files.append(GifFile(file, host=self.host, gif_type=consts.MP4, audio=False, duration=info['duration'],
                                   size=info['size']/1000000))
         return True
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread safe key value store where entries go stale after ttl seconds. If a maxsize is given, the least
+    recently used entries are dropped to stay under it"""
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Get a fresh value, stale values count as missing"""
+        entry = self.get_entry(key)
+        if entry is None or not entry[1]:
+            return default
+        return entry[0]
+
+    def get_entry(self, key):
+        """Returns (value, fresh) or None if we don't have the key at all"""
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+        value, stored = entry
+        return value, time.monotonic() - stored < self.ttl
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            if self.maxsize:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop a key or everything if no key is given"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __contains__(self, key):
+        return self.get_entry(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
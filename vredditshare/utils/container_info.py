@@ -0,0 +1,440 @@
+import struct
+
+"""Reads duration, dimensions, frame rate and tracks out of MP4 (ISO-BMFF) and WebM (EBML) headers without spawning
+FFprobe. Only the boxes/elements we need are read, media data gets skipped over with seeks."""
+
+MP4 = "mp4"
+WEBM = "webm"
+
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+
+# Codec names the way FFprobe reports them
+MP4_CODECS = {b"avc1": "h264", b"avc3": "h264", b"hvc1": "hevc", b"hev1": "hevc", b"vp09": "vp9", b"av01": "av1",
+              b"mp4v": "mpeg4", b"mp4a": "aac", b"Opus": "opus", b"ac-3": "ac3", b"ec-3": "eac3", b".mp3": "mp3"}
+WEBM_CODECS = {"V_VP8": "vp8", "V_VP9": "vp9", "V_AV1": "av1", "V_MPEG4/ISO/AVC": "h264", "A_VORBIS": "vorbis",
+               "A_OPUS": "opus", "A_AAC": "aac"}
+
+# Boxes that only hold other boxes
+MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"mvex", b"moof", b"traf"}
+# Don't read a box into memory if it's bigger than this, moov is usually well under a MB
+MAX_BOX_SIZE = 64 * 1024 * 1024
+
+
+class ContainerParseError(Exception):
+    pass
+
+
+class Track:
+    def __init__(self):
+        self.id = None
+        self.kind = None    # video or audio
+        self.codec = None
+        self.width = None
+        self.height = None
+        self.timescale = None
+        self.duration = None    # In seconds
+        self.frame_count = None
+        self.fps = None
+        # Fragmented MP4 defaults
+        self.default_sample_duration = 0
+
+
+class ContainerInfo:
+    def __init__(self, format, tracks, duration):
+        self.format = format
+        self.tracks = tracks
+        self.duration = duration
+        self.video = next((t for t in tracks if t.kind == "video"), None)
+        self.audio = next((t for t in tracks if t.kind == "audio"), None)
+        # MP4 only. Whether the moov box comes before the media data, which lets players start without the whole file
+        self.moov_at_start = None
+        self.fragmented = False
+
+    @property
+    def dimensions(self):
+        if self.video and self.video.width:
+            return self.video.width, self.video.height
+        return None
+
+    @property
+    def frame_count(self):
+        return self.video.frame_count if self.video else None
+
+    @property
+    def fps(self):
+        if not self.video:
+            return None
+        if self.video.fps:
+            return self.video.fps
+        if self.video.frame_count and self.video.duration:
+            return self.video.frame_count / self.video.duration
+        return None
+
+    def __repr__(self):
+        return f"ContainerInfo({self.format}, {self.dimensions}, {self.duration}s, {self.fps}fps, " \
+               f"audio={self.audio is not None})"
+
+
+def container_type(filestream):
+    """Sniff the magic bytes, filestream can be a file-like object or a path"""
+    if isinstance(filestream, str):
+        with open(filestream, "rb") as f:
+            header = f.read(12)
+    else:
+        filestream.seek(0)
+        header = filestream.read(12)
+        filestream.seek(0)
+    if header[4:8] == b"ftyp":
+        return MP4
+    if header[:4] == EBML_MAGIC:
+        return WEBM
+    return None
+
+
+def read_container(filestream) -> ContainerInfo:
+    """Read an MP4 or WebM's metadata, filestream can be a file-like object or a path"""
+    if isinstance(filestream, str):
+        with open(filestream, "rb") as f:
+            return read_container(f)
+    kind = container_type(filestream)
+    try:
+        if kind == MP4:
+            info = _read_mp4(filestream)
+        elif kind == WEBM:
+            info = _read_webm(filestream)
+        else:
+            raise ContainerParseError("Not an MP4 or WebM")
+    except (struct.error, IndexError, ValueError) as e:
+        raise ContainerParseError(f"Malformed {kind}: {e}")
+    finally:
+        filestream.seek(0)
+    return info
+
+
+# MP4
+
+def _file_size(f):
+    position = f.tell()
+    size = f.seek(0, 2)
+    f.seek(position)
+    return size
+
+
+def _box_header(f, end):
+    """Returns (type, payload start, box end) for the box at the current position"""
+    start = f.tell()
+    header = f.read(8)
+    if len(header) < 8:
+        return None
+    size, box_type = struct.unpack(">I4s", header)
+    if size == 1:
+        size = struct.unpack(">Q", f.read(8))[0]
+    elif size == 0:
+        size = end - start
+    if size < 8:
+        raise ContainerParseError(f"Bad box size {size} for {box_type}")
+    return box_type, f.tell(), start + size
+
+
+def _iter_boxes(data, offset=0, end=None):
+    """Walk boxes that are already in memory, yields (type, payload)"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ContainerParseError(f"Bad box size {size} for {box_type}")
+        yield box_type, data[offset + header:offset + size]
+        offset += size
+
+
+def _read_mp4(f):
+    end = _file_size(f)
+    f.seek(0)
+    moov = None
+    moov_position = None
+    mdat_position = None
+    moofs = []
+    while f.tell() < end:
+        header = _box_header(f, end)
+        if not header:
+            break
+        box_type, payload, box_end = header
+        if box_type == b"moov":
+            moov_position = payload
+            if box_end - payload > MAX_BOX_SIZE:
+                raise ContainerParseError("moov box too large")
+            moov = f.read(box_end - payload)
+        elif box_type == b"moof":
+            moofs.append(f.read(min(box_end - payload, MAX_BOX_SIZE)))
+        elif box_type == b"mdat" and mdat_position is None:
+            mdat_position = payload
+        f.seek(box_end)
+    if moov is None:
+        raise ContainerParseError("No moov box")
+
+    movie_timescale = None
+    movie_duration = None
+    fragment_duration = None
+    tracks = []
+    trex_defaults = {}
+    for box_type, payload in _iter_boxes(moov):
+        if box_type == b"mvhd":
+            movie_timescale, duration = _read_time_header(payload)
+            if movie_timescale and duration:
+                movie_duration = duration / movie_timescale
+        elif box_type == b"trak":
+            tracks.append(_read_trak(payload))
+        elif box_type == b"mvex":
+            for child_type, child in _iter_boxes(payload):
+                if child_type == b"trex":
+                    track_id, _, sample_duration = struct.unpack_from(">III", child, 4)
+                    trex_defaults[track_id] = sample_duration
+                elif child_type == b"mehd":
+                    fragment_duration = struct.unpack_from(">Q" if child[0] == 1 else ">I", child, 4)[0]
+
+    for track in tracks:
+        track.default_sample_duration = trex_defaults.get(track.id, 0)
+
+    info = ContainerInfo(MP4, tracks, None)
+    info.moov_at_start = mdat_position is None or moov_position < mdat_position
+    if moofs:
+        info.fragmented = True
+        _read_fragments(moofs, tracks)
+
+    for track in tracks:
+        if track.kind == "video" and track.frame_count and track.duration:
+            track.fps = track.frame_count / track.duration
+    # Prefer the movie header, but fragmented files often leave it empty
+    if movie_duration and not info.fragmented:
+        info.duration = movie_duration
+    else:
+        info.duration = max((t.duration for t in tracks if t.duration), default=None)
+        if not info.duration and fragment_duration and movie_timescale:
+            info.duration = fragment_duration / movie_timescale
+    return info
+
+
+def _read_time_header(payload):
+    """Timescale and duration out of an mvhd or mdhd"""
+    version = payload[0]
+    if version == 1:
+        return struct.unpack_from(">IQ", payload, 20)
+    return struct.unpack_from(">II", payload, 12)
+
+
+def _read_trak(trak):
+    track = Track()
+    for box_type, payload in _iter_boxes(trak):
+        if box_type == b"tkhd":
+            version = payload[0]
+            track.id = struct.unpack_from(">I", payload, 20 if version == 1 else 12)[0]
+            width, height = struct.unpack_from(">II", payload, len(payload) - 8)
+            track.width, track.height = width >> 16, height >> 16
+        elif box_type == b"mdia":
+            _read_mdia(payload, track)
+    return track
+
+
+def _read_mdia(mdia, track):
+    for box_type, payload in _iter_boxes(mdia):
+        if box_type == b"mdhd":
+            track.timescale, duration = _read_time_header(payload)
+            if track.timescale and duration:
+                track.duration = duration / track.timescale
+        elif box_type == b"hdlr":
+            handler = payload[8:12]
+            track.kind = {b"vide": "video", b"soun": "audio"}.get(handler, None)
+        elif box_type == b"minf":
+            for minf_type, minf in _iter_boxes(payload):
+                if minf_type == b"stbl":
+                    _read_stbl(minf, track)
+
+
+def _read_stbl(stbl, track):
+    for box_type, payload in _iter_boxes(stbl):
+        if box_type == b"stsd":
+            entries = struct.unpack_from(">I", payload, 4)[0]
+            if entries:
+                codec = payload[12:16]
+                track.codec = MP4_CODECS.get(codec, codec.decode("latin-1").strip())
+                if track.kind == "video":
+                    # VisualSampleEntry, after the box header and the 8 bytes of SampleEntry + 16 bytes of padding
+                    width, height = struct.unpack_from(">HH", payload, 8 + 8 + 8 + 16)
+                    if width and height:
+                        track.width, track.height = width, height
+        elif box_type == b"stts":
+            entries = struct.unpack_from(">I", payload, 4)[0]
+            if entries:
+                track.frame_count = sum(struct.unpack_from(">I", payload, 8 + i * 8)[0] for i in range(entries))
+
+
+def _read_fragments(moofs, tracks):
+    """Fragmented MP4s (like Reddit's DASH files) keep their samples in moof boxes rather than the moov"""
+    by_id = {t.id: t for t in tracks}
+    samples = {t.id: 0 for t in tracks}
+    durations = {t.id: 0 for t in tracks}
+    for moof in moofs:
+        for box_type, traf in _iter_boxes(moof):
+            if box_type != b"traf":
+                continue
+            track_id = None
+            default_duration = 0
+            for traf_type, payload in _iter_boxes(traf):
+                if traf_type == b"tfhd":
+                    flags = int.from_bytes(payload[1:4], "big")
+                    track_id = struct.unpack_from(">I", payload, 4)[0]
+                    track = by_id.get(track_id, None)
+                    default_duration = track.default_sample_duration if track else 0
+                    offset = 8
+                    if flags & 0x01:    # base data offset
+                        offset += 8
+                    if flags & 0x02:    # sample description index
+                        offset += 4
+                    if flags & 0x08:    # default sample duration
+                        default_duration = struct.unpack_from(">I", payload, offset)[0]
+                elif traf_type == b"trun" and track_id in by_id:
+                    flags = int.from_bytes(payload[1:4], "big")
+                    count = struct.unpack_from(">I", payload, 4)[0]
+                    samples[track_id] += count
+                    offset = 8
+                    if flags & 0x01:    # data offset
+                        offset += 4
+                    if flags & 0x04:    # first sample flags
+                        offset += 4
+                    if flags & 0x100:   # Every sample has its own duration
+                        stride = 4 * sum(1 for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit)
+                        durations[track_id] += sum(struct.unpack_from(">I", payload, offset + i * stride)[0]
+                                                   for i in range(count))
+                    else:
+                        durations[track_id] += default_duration * count
+    for track in tracks:
+        if samples[track.id]:
+            track.frame_count = (track.frame_count or 0) + samples[track.id]
+            if track.timescale and durations[track.id]:
+                track.duration = (track.duration or 0) + durations[track.id] / track.timescale
+
+
+# WebM
+
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TRACKS = 0x1654AE6B
+CLUSTER = 0x1F43B675
+TIMECODE_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+DEFAULT_DURATION = 0x23E383
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+
+
+def _read_vint(f, keep_marker):
+    """EBML variable length integer. IDs keep their length marker, sizes don't. Returns (value, unknown size)"""
+    first = f.read(1)
+    if not first:
+        return None, False
+    first = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ContainerParseError("Bad EBML integer")
+    value = first if keep_marker else first & (mask - 1)
+    rest = f.read(length - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, unknown
+
+
+def _read_elements(f, end):
+    """Yields (id, payload start, payload end) for elements until end"""
+    while f.tell() < end:
+        element_id, _ = _read_vint(f, True)
+        if element_id is None:
+            return
+        size, unknown = _read_vint(f, False)
+        if size is None:
+            return
+        start = f.tell()
+        yield element_id, start, end if unknown else start + size
+
+
+def _read_uint(f, start, end):
+    f.seek(start)
+    return int.from_bytes(f.read(end - start), "big")
+
+
+def _read_webm(f):
+    end = _file_size(f)
+    f.seek(0)
+    timecode_scale = 1000000
+    duration = None
+    tracks = []
+    for element_id, start, element_end in _read_elements(f, end):
+        if element_id != SEGMENT:
+            f.seek(element_end)
+            continue
+        for child_id, child_start, child_end in _read_elements(f, element_end):
+            if child_id == INFO:
+                for info_id, info_start, info_end in _read_elements(f, child_end):
+                    if info_id == TIMECODE_SCALE:
+                        timecode_scale = _read_uint(f, info_start, info_end)
+                    elif info_id == DURATION:
+                        f.seek(info_start)
+                        raw = f.read(info_end - info_start)
+                        duration = struct.unpack(">f" if len(raw) == 4 else ">d", raw)[0]
+                    f.seek(info_end)
+            elif child_id == TRACKS:
+                for entry_id, entry_start, entry_end in _read_elements(f, child_end):
+                    if entry_id == TRACK_ENTRY:
+                        tracks.append(_read_track_entry(f, entry_end))
+                    f.seek(entry_end)
+            elif child_id == CLUSTER and tracks and duration is not None:
+                # Everything we need comes before the media
+                break
+            f.seek(child_end)
+        break
+    if duration is not None:
+        duration = duration * timecode_scale / 1000000000
+    for track in tracks:
+        track.duration = duration
+    return ContainerInfo(WEBM, tracks, duration)
+
+
+def _read_track_entry(f, end):
+    track = Track()
+    for element_id, start, element_end in _read_elements(f, end):
+        if element_id == TRACK_NUMBER:
+            track.id = _read_uint(f, start, element_end)
+        elif element_id == TRACK_TYPE:
+            track.kind = {1: "video", 2: "audio"}.get(_read_uint(f, start, element_end), None)
+        elif element_id == CODEC_ID:
+            f.seek(start)
+            codec = f.read(element_end - start).rstrip(b"\0").decode("ascii", "replace")
+            track.codec = WEBM_CODECS.get(codec, codec)
+        elif element_id == DEFAULT_DURATION:
+            frame_duration = _read_uint(f, start, element_end)
+            if frame_duration:
+                track.fps = 1000000000 / frame_duration
+        elif element_id == VIDEO:
+            for video_id, video_start, video_end in _read_elements(f, element_end):
+                if video_id == PIXEL_WIDTH:
+                    track.width = _read_uint(f, video_start, video_end)
+                elif video_id == PIXEL_HEIGHT:
+                    track.height = _read_uint(f, video_start, video_end)
+                f.seek(video_end)
+        f.seek(element_end)
+    return track
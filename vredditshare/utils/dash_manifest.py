@@ -0,0 +1,130 @@
+import re
+import xml.etree.ElementTree as ElementTree
+from urllib.parse import urljoin
+
+"""Just enough of an MPEG-DASH manifest reader to list the renditions of a video, like the DASHPlaylist.mpd Reddit
+serves next to every v.redd.it video"""
+
+VIDEO = "video"
+AUDIO = "audio"
+
+ISO_DURATION = re.compile(r"P(?:(?P<days>[\d.]+)D)?(?:T(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?"
+                          r"(?:(?P<seconds>[\d.]+)S)?)?$")
+
+
+class ManifestParseError(Exception):
+    pass
+
+
+class Representation:
+    def __init__(self, kind, url, bandwidth, width=None, height=None):
+        self.kind = kind
+        self.url = url
+        # Bits per second
+        self.bandwidth = bandwidth
+        self.width = width
+        self.height = height
+
+    def estimated_size(self, duration):
+        """Bytes this rendition should take up for a given duration"""
+        return self.bandwidth * duration / 8
+
+    def __repr__(self):
+        return f"Representation({self.kind}, {self.width}x{self.height}, {self.bandwidth}bps, {self.url})"
+
+
+class Manifest:
+    def __init__(self, duration, representations):
+        self.duration = duration
+        self.representations = representations
+
+    @property
+    def videos(self):
+        """Video renditions, highest bandwidth first"""
+        return sorted((r for r in self.representations if r.kind == VIDEO), key=lambda r: r.bandwidth,
+                      reverse=True)
+
+    @property
+    def audio(self):
+        """The highest bandwidth audio rendition, if there is any audio"""
+        audio = [r for r in self.representations if r.kind == AUDIO]
+        return max(audio, key=lambda r: r.bandwidth) if audio else None
+
+    def __repr__(self):
+        return f"Manifest({self.duration}s, {self.representations})"
+
+
+def parse_duration(text):
+    """Seconds in an ISO 8601 duration like PT1M2.5S"""
+    match = ISO_DURATION.match(text.strip()) if text else None
+    if not match:
+        return None
+    parts = {k: float(v) if v else 0 for k, v in match.groupdict().items()}
+    return parts['days'] * 86400 + parts['hours'] * 3600 + parts['minutes'] * 60 + parts['seconds']
+
+
+def _local(tag):
+    """Tag name without the namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local(child.tag) == name]
+
+
+def _base_text(element):
+    for child in _children(element, "BaseURL"):
+        if child.text and child.text.strip():
+            return child.text.strip()
+    return None
+
+
+def _base_url(element, base):
+    text = _base_text(element)
+    return urljoin(base, text) if text else base
+
+
+def _kind(element):
+    content_type = element.get("contentType", "")
+    mime_type = element.get("mimeType", "")
+    for kind in (VIDEO, AUDIO):
+        if content_type == kind or mime_type.startswith(kind + "/"):
+            return kind
+    return None
+
+
+def parse_manifest(text, url) -> Manifest:
+    """Read the renditions out of a DASH manifest. url is where the manifest came from, renditions are relative to
+    it"""
+    try:
+        root = ElementTree.fromstring(text)
+    except ElementTree.ParseError as e:
+        raise ManifestParseError(f"Bad manifest XML: {e}")
+    if _local(root.tag) != "MPD":
+        raise ManifestParseError("Not a DASH manifest")
+    base = _base_url(root, url)
+    duration = parse_duration(root.get("mediaPresentationDuration"))
+
+    representations = []
+    for period in _children(root, "Period"):
+        period_base = _base_url(period, base)
+        if duration is None:
+            duration = parse_duration(period.get("duration"))
+        for adaptation in _children(period, "AdaptationSet"):
+            adaptation_base = _base_url(adaptation, period_base)
+            for representation in _children(adaptation, "Representation"):
+                kind = _kind(representation) or _kind(adaptation)
+                bandwidth = representation.get("bandwidth")
+                if kind is None or bandwidth is None:
+                    continue
+                rep_url = _base_text(representation)
+                if rep_url is None:
+                    continue
+                width = representation.get("width", adaptation.get("width"))
+                height = representation.get("height", adaptation.get("height"))
+                representations.append(Representation(kind, urljoin(adaptation_base, rep_url), int(bandwidth),
+                                                      int(width) if width else None,
+                                                      int(height) if height else None))
+    if not representations:
+        raise ManifestParseError("No usable representations")
+    return Manifest(duration, representations)
@@ -0,0 +1,234 @@
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
+from requests import RequestException
+from ..core.credentials import CredentialsLoader
+from .http import Sessions
+from .media_buffer import MediaBuffer, CHUNK_SIZE
+
+"""Downloads media into a MediaBuffer. Big files are fetched as several byte ranges at once when the server supports
+it, which gets around the per-connection speed limit on slow CDN paths. Everything else is a single stream.
+
+download_segments sets how many ranges are fetched at once and segment_min_size (MB) how big a file has to be for
+it to be split, both in the general section of the credentials file."""
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+# Shared by every download so the number of extra connections stays bounded
+segment_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="segment")
+
+
+class DownloadStats:
+    def __init__(self, url, size, seconds, segments):
+        self.url = url
+        # Bytes
+        self.size = size
+        self.seconds = seconds
+        # 1 for a single stream
+        self.segments = segments
+
+    @property
+    def throughput(self):
+        """Bytes per second"""
+        return self.size / self.seconds if self.seconds else 0
+
+    def __repr__(self):
+        return f"DownloadStats({self.size / 1000000}MB in {round(self.seconds, 2)}s, " \
+               f"{round(self.throughput / 1000000, 2)}MB/s, {self.segments} segments)"
+
+
+class DownloadMetrics:
+    """Recent downloads, for seeing how fast we're pulling media in"""
+    history = deque(maxlen=200)
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, stats: DownloadStats):
+        with cls._lock:
+            cls.history.append(stats)
+
+    @classmethod
+    def summary(cls):
+        with cls._lock:
+            history = list(cls.history)
+        size = sum(s.size for s in history)
+        seconds = sum(s.seconds for s in history)
+        return {"downloads": len(history), "bytes": size,
+                "throughput": size / seconds if seconds else 0,
+                "segmented": sum(1 for s in history if s.segments > 1)}
+
+
+def _config():
+    config = CredentialsLoader.get_credentials()['general']
+    return max(int(config.get('download_segments', 4)), 1), \
+        int(float(config.get('segment_min_size', 8)) * 1000000)
+
+
+def _content_range(response):
+    """(start, end, total) from a 206's Content-Range, None if it doesn't have a usable one"""
+    match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+    if not match:
+        return None
+    return tuple(int(i) for i in match.groups())
+
+
+def _fill(buffer, response, offset, stop=None):
+    """Write a response's body into the buffer starting at offset. Returns how many bytes were written. Gives up if
+    the stop event gets set"""
+    written = 0
+    with response:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if stop is not None and stop.is_set():
+                raise RequestException("Download stopped")
+            buffer.write_at(offset + written, chunk)
+            written += len(chunk)
+    return written
+
+
+def _fetch_range(session, url, headers, start, end, buffer, stop=None):
+    if stop is not None and stop.is_set():
+        raise RequestException("Download stopped")
+    r = session.get(url, headers={**headers, "Range": f"bytes={start}-{end}"}, stream=True)
+    if r.status_code != 206 or _content_range(r) is None or _content_range(r)[0] != start:
+        r.close()
+        raise RequestException(f"Range request for {start}-{end} returned status {r.status_code}")
+    written = _fill(buffer, r, start, stop)
+    if written != end - start + 1:
+        raise RequestException(f"Range {start}-{end} came back with {written} bytes")
+    return written
+
+
+def content_length(url, session=None, headers=None):
+    """Size in bytes the server says the file is, without downloading it. None if it doesn't say"""
+    if session is None:
+        session = Sessions.get("download")
+    try:
+        r = session.head(url, headers=headers, allow_redirects=True)
+    except RequestException as e:
+        print("Couldn't get size of", url, e)
+        return None
+    length = r.headers.get("Content-Length", "")
+    if r.status_code != 200 or not length.isdigit():
+        return None
+    return int(length)
+
+
+def download(url, session=None, headers=None, max_size=None, segments=None) -> Optional[MediaBuffer]:
+    """Download url into a MediaBuffer. Returns None if the server gives an error, the connection fails or if
+    max_size (bytes) is given and the file is bigger than it"""
+    try:
+        return _download(url, session, headers, max_size, segments)
+    except RequestException as e:
+        print("Couldn't download", url, e)
+        return None
+
+
+def _download(url, session, headers, max_size, segments):
+    if session is None:
+        session = Sessions.get("download")
+    default_segments, min_size = _config()
+    segments = segments or default_segments
+    # Compressed responses can't be split by byte range
+    headers = {**(headers or {}), "Accept-Encoding": "identity"}
+    start = time.time()
+
+    # Ask for the first segment. A server that supports ranges tells us the full size, one that doesn't just sends
+    # the whole file and we carry on with that
+    first_end = min_size - 1
+    r = session.get(url, headers={**headers, "Range": f"bytes=0-{first_end}"}, stream=True)
+    content_range = _content_range(r) if r.status_code == 206 else None
+    if r.status_code == 206 and content_range:
+        total = content_range[2]
+        if max_size and total > max_size:
+            print(f"{url} is too big ({total / 1000000}MB)")
+            r.close()
+            return None
+        buffer = MediaBuffer()
+        try:
+            buffer.preallocate(total)
+            if total - 1 > first_end and segments > 1:
+                try:
+                    count = _download_segments(session, url, headers, buffer, r, first_end + 1, total, segments)
+                except (RequestException, OSError) as e:
+                    # Every segment has stopped by now, start over with a fresh buffer
+                    print("Segmented download failed, trying again as one stream", e)
+                    buffer.close()
+                    return _download_stream(session, url, headers, max_size, start)
+            else:
+                # Small enough that the first request got the whole thing, or we aren't splitting
+                written = _fill(buffer, r, 0)
+                if total - 1 > first_end:
+                    written += _fetch_range(session, url, headers, written, total - 1, buffer)
+                count = 1
+        except BaseException:
+            r.close()
+            buffer.close()
+            raise
+        buffer.seek(0)
+        _record(url, total, start, count)
+        return buffer
+    if r.status_code == 200:
+        return _stream_response(url, r, max_size, start)
+    if r.status_code == 206:
+        # Partial content without a total size we can read (bytes 0-N/*), ask for the whole thing instead
+        r.close()
+        return _download_stream(session, url, headers, max_size, start)
+    print("Getting", url, "returned status", r.status_code)
+    r.close()
+    return None
+
+
+def _download_segments(session, url, headers, buffer, first_response, offset, total, segments):
+    """Fetch offset to the end of the file as segments ranges at once, while the first range is read here. If any
+    range fails, the rest are stopped before this returns so nothing writes to the buffer afterwards"""
+    remaining = total - offset
+    size = -(-remaining // segments)
+    stop = threading.Event()
+    futures = []
+    for start in range(offset, total, size):
+        futures.append(segment_pool.submit(_fetch_range, session, url, headers, start,
+                                           min(start + size, total) - 1, buffer, stop))
+    try:
+        if _fill(buffer, first_response, 0, stop) != offset:
+            raise RequestException("First range came back short")
+        for future in futures:
+            future.result()
+    except BaseException:
+        stop.set()
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+    return len(futures) + 1
+
+
+def _download_stream(session, url, headers, max_size, start):
+    r = session.get(url, headers=headers, stream=True)
+    if r.status_code != 200:
+        print("Getting", url, "returned status", r.status_code)
+        r.close()
+        return None
+    return _stream_response(url, r, max_size, start)
+
+
+def _stream_response(url, response, max_size, start):
+    length = response.headers.get("Content-Length", None)
+    if max_size and length and length.isdigit() and int(length) > max_size:
+        print(f"{url} is too big ({int(length) / 1000000}MB)")
+        response.close()
+        return None
+    buffer = MediaBuffer.download(url, response=response, max_size=max_size)
+    if buffer is None:
+        print(f"{url} went over {max_size / 1000000}MB")
+        return None
+    _record(url, len(buffer), start, 1)
+    return buffer
+
+
+def _record(url, size, start, segments):
+    stats = DownloadStats(url, size, time.time() - start, segments)
+    DownloadMetrics.record(stats)
+    print("Downloaded", url, stats)
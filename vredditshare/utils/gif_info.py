@@ -0,0 +1,168 @@
+import mmap
+import os
+import struct
+
+"""Reads GIF metadata straight from the block structure without decoding any pixels. Much faster than having ffprobe
+count frames since we only need to hop from block to block."""
+
+GIF_MAGIC = (b"GIF87a", b"GIF89a")
+
+EXTENSION = 0x21
+IMAGE = 0x2C
+TRAILER = 0x3B
+GRAPHIC_CONTROL = 0xF9
+APPLICATION = 0xFF
+LOOP_APPLICATIONS = (b"NETSCAPE2.0", b"ANIMEXTS1.0")
+
+# Like browsers and FFmpeg, delays under 2 hundredths of a second get bumped up to 10
+MIN_DELAY = 2
+DEFAULT_DELAY = 10
+
+# Frame is cleared to the background before the next one is drawn
+RESTORE_BACKGROUND = 2
+
+
+class GifParseError(Exception):
+    pass
+
+
+class GifInfo:
+    def __init__(self, width, height, delays, loop_count, truncated, transparent=False):
+        self.width = width
+        self.height = height
+        # Delay of each frame in seconds
+        self.delays = delays
+        # None if the gif plays once, 0 if it loops forever
+        self.loop_count = loop_count
+        # If the file ended before the trailer
+        self.truncated = truncated
+        # If any transparent pixels actually show. Transparency that only lets the previous frame show through
+        # doesn't count
+        self.transparent = transparent
+
+    @property
+    def dimensions(self):
+        return self.width, self.height
+
+    @property
+    def frame_count(self):
+        return len(self.delays)
+
+    @property
+    def duration(self):
+        # Delays are in hundredths of a second, rounding gets rid of the float error from adding them up
+        return round(sum(self.delays), 2)
+
+    @property
+    def fps(self):
+        if self.duration:
+            return self.frame_count / self.duration
+        return None
+
+    @property
+    def loops(self):
+        return self.loop_count is not None
+
+    def __repr__(self):
+        return f"GifInfo({self.width}x{self.height}, {self.frame_count} frames, {round(self.duration, 2)}s)"
+
+
+def is_gif(filestream):
+    """Check the magic bytes, filestream can be a file-like object or a path"""
+    if isinstance(filestream, str):
+        with open(filestream, "rb") as f:
+            return f.read(6) in GIF_MAGIC
+    filestream.seek(0)
+    header = filestream.read(6)
+    filestream.seek(0)
+    return header in GIF_MAGIC
+
+
+def parse_gif(filestream) -> GifInfo:
+    """Get the dimensions, frame delays and loop count of a gif, filestream can be a file-like object or a path"""
+    if isinstance(filestream, str):
+        with open(filestream, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise GifParseError("Empty file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return _parse(buffer)
+    if hasattr(filestream, "getbuffer"):     # BytesIO and MediaBuffer
+        with filestream.getbuffer() as buffer:
+            return _parse(buffer)
+    filestream.seek(0)
+    data = filestream.read()
+    filestream.seek(0)
+    return _parse(data)
+
+
+def _parse(buffer) -> GifInfo:
+    length = len(buffer)
+    if length < 13 or bytes(buffer[:6]) not in GIF_MAGIC:
+        raise GifParseError("Not a gif")
+    width, height, flags = struct.unpack_from("<HHB", buffer, 6)
+    position = 13
+    if flags & 0x80:
+        # Skip the global color table
+        position += 3 * (2 << (flags & 0x07))
+
+    delays = []
+    loop_count = None
+    delay = None
+    # Graphic control flags for the next frame and how the last frame was disposed of
+    control = None
+    disposal = 0
+    transparent = False
+    truncated = True
+    try:
+        while position < length:
+            block = buffer[position]
+            position += 1
+            if block == IMAGE:
+                flags = buffer[position + 8]
+                position += 9
+                if flags & 0x80:
+                    # Skip the local color table
+                    position += 3 * (2 << (flags & 0x07))
+                # Skip the LZW minimum code size, then the image data
+                position = _skip_sub_blocks(buffer, position + 1, length)
+                # A transparent color only shows through to nothing on the first frame or over a cleared frame
+                if control is not None and control & 0x01 and (not delays or disposal == RESTORE_BACKGROUND):
+                    transparent = True
+                disposal = (control >> 2) & 0x07 if control is not None else 0
+                delays.append((delay if delay is not None and delay >= MIN_DELAY else DEFAULT_DELAY) / 100)
+                delay = None
+                control = None
+            elif block == EXTENSION:
+                label = buffer[position]
+                position += 1
+                if label == GRAPHIC_CONTROL and buffer[position] >= 4:
+                    control = buffer[position + 1]
+                    delay = struct.unpack_from("<H", buffer, position + 2)[0]
+                elif label == APPLICATION and buffer[position] == 11 and \
+                        bytes(buffer[position + 1:position + 12]) in LOOP_APPLICATIONS:
+                    sub_block = position + 12
+                    if buffer[sub_block] >= 3 and buffer[sub_block + 1] == 1:
+                        loop_count = struct.unpack_from("<H", buffer, sub_block + 2)[0]
+                position = _skip_sub_blocks(buffer, position, length)
+            elif block == TRAILER:
+                truncated = False
+                break
+            else:
+                raise GifParseError(f"Unknown block 0x{block:02x} at {position - 1}")
+    except (IndexError, struct.error):
+        # Ran off the end of the file in the middle of a block, keep whatever full frames we got
+        pass
+    if not delays:
+        raise GifParseError("No frames")
+    return GifInfo(width, height, delays, loop_count, truncated, transparent)
+
+
+def _skip_sub_blocks(buffer, position, length):
+    """Returns the position after a chain of data sub-blocks"""
+    while True:
+        if position >= length:
+            raise IndexError
+        size = buffer[position]
+        position += size + 1
+        if size == 0:
+            return position
@@ -0,0 +1,77 @@
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..core.credentials import CredentialsLoader
+
+"""Shared HTTP sessions, one per host, so connections (and their TLS handshakes) get reused between requests. Every
+session has connect/read timeouts and retries connection errors and 429/5xx responses with a jittered backoff.
+Retries only apply to requests that are safe to repeat, uploads are never sent twice.
+
+Tune in the general section of the credentials file:
+http_connect_timeout, http_read_timeout, http_upload_timeout (seconds), http_retries, http_backoff (seconds),
+http_pool_size"""
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TimeoutSession(requests.Session):
+    """A session that applies a default timeout to every request unless one is given"""
+    def __init__(self, timeout):
+        super(TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super(TimeoutSession, self).request(method, url, **kwargs)
+
+
+class Sessions:
+    _sessions = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name) -> requests.Session:
+        """Get the session for a host, making it if this is the first time it's been asked for"""
+        with cls._lock:
+            session = cls._sessions.get(name, None)
+            if session is None:
+                session = cls._make_session()
+                cls._sessions[name] = session
+            return session
+
+    @classmethod
+    def _make_session(cls):
+        config = CredentialsLoader.get_credentials()['general']
+        retries = int(config.get('http_retries', 3))
+        pool_size = int(config.get('http_pool_size', 10))
+        timeout = (float(config.get('http_connect_timeout', 10)), float(config.get('http_read_timeout', 60)))
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      status_forcelist=RETRY_STATUSES, backoff_factor=float(config.get('http_backoff', 1)),
+                      backoff_jitter=float(config.get('http_backoff', 1)), respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = TimeoutSession(timeout)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def upload_timeout(cls):
+        """Timeout for uploads, where the host can take a while to answer after getting the file"""
+        config = CredentialsLoader.get_credentials()['general']
+        return float(config.get('http_connect_timeout', 10)), float(config.get('http_upload_timeout', 600))
+
+    @classmethod
+    def backoff(cls, attempt):
+        """Seconds to wait before retrying something the sessions can't retry for us, like a failed upload"""
+        backoff = float(CredentialsLoader.get_credentials()['general'].get('http_backoff', 1))
+        return backoff * 2 ** attempt + random.uniform(0, backoff)
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
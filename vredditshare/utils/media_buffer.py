@@ -0,0 +1,197 @@
+import io
+import mmap
+import os
+import threading
+from ..core.credentials import CredentialsLoader
+from .temp_folder import TempFolder, ScratchSpace
+from .http import Sessions
+
+CHUNK_SIZE = 256 * 1024
+# How far past what has been checked a spilled buffer can grow before the scratch quota is checked again
+QUOTA_STEP = 16 * 1000000
+
+
+def spool_threshold():
+    """Bytes a buffer can hold in memory before it moves to disk"""
+    return int(float(CredentialsLoader.get_credentials()['general'].get('spool_threshold', 16)) * 1000000)
+
+
+class MediaBuffer(io.IOBase):
+    """A file-like buffer for media. It acts like a BytesIO until it grows past the spool threshold, then moves
+    itself into a file in a disk backed scratch folder so big downloads don't sit in memory. getbuffer() works in both
+    cases, once it's on disk it is backed by an mmap of the file. Growth on disk counts against the scratch quota.
+
+    Once spilled, name is the path of the file so subprocesses can read it directly."""
+    def __init__(self, threshold=None, prefix="media"):
+        super(MediaBuffer, self).__init__()
+        self.threshold = spool_threshold() if threshold is None else threshold
+        self.prefix = prefix
+        self._file = io.BytesIO()
+        self._folder = None
+        self._mmap = None
+        self._lock = threading.Lock()
+        # Bytes reserved against the scratch quota, given back when the buffer is closed
+        self._charged = 0
+        self.name = None
+
+    @classmethod
+    def download(cls, url, response=None, max_size=None, chunk_size=CHUNK_SIZE, session=None, **kwargs):
+        """Stream a url into a new buffer. Extra keyword arguments go to the session's get, or pass an already open
+        streaming response. Returns None if max_size (bytes) is given and the download goes over it"""
+        if response is None:
+            if session is None:
+                session = Sessions.get("download")
+            response = session.get(url, stream=True, **kwargs)
+        buffer = cls()
+        try:
+            with response:
+                for chunk in response.iter_content(chunk_size):
+                    buffer.write(chunk)
+                    if max_size and buffer.tell() > max_size:
+                        buffer.close()
+                        return None
+        except BaseException:
+            # Connection dropped or the quota ran out, don't leave the half written file around
+            buffer.close()
+            raise
+        buffer.seek(0)
+        return buffer
+
+    @property
+    def spilled(self):
+        return self._folder is not None
+
+    def _charge(self, end):
+        """Reserve quota before the file on disk grows to end bytes. Reserves a step ahead so it isn't done on every
+        write"""
+        if end > self._charged:
+            ScratchSpace.reserve(end + QUOTA_STEP - self._charged)
+            self._charged = end + QUOTA_STEP
+
+    def _spill(self, size=0):
+        """Move to disk, with room for size bytes as far as the quota is concerned"""
+        self._charge(max(size, len(self)))
+        self._folder = TempFolder(self.prefix, disk=True)
+        path = self._folder.folder / "buffer"
+        position = self._file.tell()
+        disk = open(path, "w+b")
+        with self._file.getbuffer() as data:
+            disk.write(data)
+        disk.seek(position)
+        self._file.close()
+        self._file = disk
+        self.name = str(path)
+
+    def _release_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def write(self, data):
+        end = self._file.tell() + len(data)
+        if not self.spilled and end > self.threshold:
+            self._spill(end)
+        elif self.spilled:
+            self._charge(end)
+        self._release_mmap()
+        return self._file.write(data)
+
+    def target(self):
+        """Path a subprocess can write the buffer's contents to directly, anything already in it is overwritten.
+        Moves the buffer to disk"""
+        if not self.spilled:
+            self._spill()
+        self._release_mmap()
+        return self.name
+
+    def preallocate(self, size):
+        """Make room for size bytes up front so parts of the file can be filled in out of order with write_at"""
+        if size > self.threshold and not self.spilled:
+            self._spill(size)
+        elif self.spilled:
+            self._charge(size)
+        position = self.tell()
+        if self.spilled and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self._file.fileno(), 0, size)
+        elif size > len(self):
+            self._file.seek(size - 1)
+            self._file.write(b"\0")
+        self._file.seek(position)
+
+    def write_at(self, offset, data):
+        """Write at an offset without moving the position, safe to call from several threads at once"""
+        with self._lock:
+            if self.spilled:
+                self._charge(offset + len(data))
+            self._release_mmap()
+            position = self._file.tell()
+            self._file.seek(offset)
+            written = self._file.write(data)
+            self._file.seek(position)
+        return written
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readinto(self, b):
+        return self._file.readinto(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def truncate(self, size=None):
+        self._release_mmap()
+        return self._file.truncate(size)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def fileno(self):
+        if not self.spilled:
+            raise io.UnsupportedOperation("fileno")
+        return self._file.fileno()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def getbuffer(self) -> memoryview:
+        """A view of the whole buffer. Read only once the buffer is on disk"""
+        if not self.spilled:
+            return self._file.getbuffer()
+        self._file.flush()
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def __len__(self):
+        if not self.spilled:
+            return self._file.getbuffer().nbytes
+        self._file.flush()
+        return os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._release_mmap()
+        except BufferError:
+            # Someone is still holding a view, the mmap is closed when it gets collected
+            self._mmap = None
+        self._file.close()
+        if self._folder:
+            self._folder.close()
+        ScratchSpace.release(self._charged)
+        self._charged = 0
+        super(MediaBuffer, self).close()
@@ -0,0 +1,55 @@
+import os
+import shutil
+from contextlib import contextmanager
+from .temp_folder import TempFolder
+
+
+def _real_path(filestream):
+    """The path of a filestream that is already a file on disk, if it is one"""
+    if isinstance(filestream, (str, os.PathLike)):
+        return str(filestream)
+    name = getattr(filestream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        # Anything still sitting in Python's write buffer needs to be in the file before something else reads it
+        filestream.flush()
+        return name
+    return None
+
+
+def _write_out(filestream, f):
+    filestream.seek(0)
+    if hasattr(filestream, "getbuffer"):
+        # Write straight out of the buffer rather than making a bytes copy of it first
+        with filestream.getbuffer() as buffer:
+            f.write(buffer)
+    else:
+        shutil.copyfileobj(filestream, f)
+    filestream.seek(0)
+
+
+@contextmanager
+def process_path(filestream, name="media"):
+    """Get a path that a subprocess like ffmpeg can open and seek around in, so it doesn't need the file piped to it.
+
+    Paths and files already on disk are used as they are. Anything else is written once into an anonymous memory file
+    which other processes can open through /proc, or into a scratch folder if the OS doesn't have those. The path is
+    only good until the with block ends."""
+    path = _real_path(filestream)
+    if path:
+        yield path
+        return
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create(name)
+        try:
+            with open(fd, "wb", closefd=False) as f:
+                _write_out(filestream, f)
+            # Our own fd through our pid, since /proc/self in the subprocess would be the subprocess
+            yield f"/proc/{os.getpid()}/fd/{fd}"
+        finally:
+            os.close(fd)
+    else:
+        temp_folder = TempFolder(name)
+        try:
+            yield str(temp_folder.write(name, filestream))
+        finally:
+            temp_folder.close()
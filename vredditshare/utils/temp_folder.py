@@ -1,9 +1,19 @@
 import os
-import pathlib
 import platform
 import shutil
+import tempfile
+import threading
 from pathlib import Path
 from ..core import constants as consts
+from ..core.credentials import CredentialsLoader
+
+OWNER_FILE = ".owner"
+
+
+class ScratchQuotaExceeded(Exception):
+    def __init__(self, usage, quota):
+        super(ScratchQuotaExceeded, self).__init__(f"Scratch space is using {usage / 1000000}MB of its "
+                                                   f"{quota / 1000000}MB quota")
 
 
 class _OSTempLocation:
@@ -23,19 +33,136 @@ class _OSTempLocation:
         if system == "Linux":
             if os.environ.get("TMPDIR", None):
                 return Path(os.environ["TMPDIR"])
+            # Keep scratch files in memory if we can
+            if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+                return Path("/dev/shm")
+            return Path("/tmp")
+        return Path(tempfile.gettempdir())
+
+    @classmethod
+    def disk_location(cls) -> Path:
+        """Somewhere backed by an actual disk, for files too big to keep in memory. /dev/shm is RAM and /tmp is
+        often tmpfs too, so Linux uses /var/tmp unless scratch_disk or TMPDIR say otherwise"""
+        configured = CredentialsLoader.get_credentials()['general'].get('scratch_disk', None)
+        if configured:
+            return Path(configured)
+        if platform.system() == "Linux":
+            if os.environ.get("TMPDIR", None):
+                return Path(os.environ["TMPDIR"])
+            if os.path.isdir("/var/tmp") and os.access("/var/tmp", os.W_OK):
+                return Path("/var/tmp")
             return Path("/tmp")
+        return cls.temp_location()
+
+
+class ScratchSpace:
+    """Where every request's temp folders live. Each folder gets a unique name and is tagged with the pid that made
+    it, so folders left behind by a crashed run can be cleaned up without touching another running instance's.
+
+    There are two roots that share the quota, one in memory if the OS has somewhere for that and one on disk for
+    files that are too big to keep in memory.
+
+    Walking the folders to check the quota would mean statting every file in them, so instead a running count is
+    kept of the space requests reserve and release. It starts from what's already there the first time it's needed."""
+    _lock = threading.RLock()
+    _roots = {}
+    _reserved = None
+
+    @classmethod
+    def root(cls, disk=False) -> Path:
+        with cls._lock:
+            root = cls._roots.get(disk, None)
+            if root is None:
+                location = _OSTempLocation.disk_location() if disk else _OSTempLocation.temp_location()
+                root = location / f"{consts.bot_name}-scratch"
+                root.mkdir(parents=True, exist_ok=True)
+                cls._roots[disk] = root
+            return root
+
+    @classmethod
+    def roots(cls):
+        """Both roots, once if they're the same place"""
+        roots = [cls.root(), cls.root(disk=True)]
+        return roots if roots[0] != roots[1] else roots[:1]
+
+    @classmethod
+    def quota(cls):
+        """Quota in bytes"""
+        return int(CredentialsLoader.get_credentials()['general'].get('scratch_quota', 4000)) * 1000000
+
+    @classmethod
+    def folders(cls):
+        return [f for root in cls.roots() for f in root.iterdir() if f.is_dir()]
+
+    @classmethod
+    def usage(cls):
+        """Bytes used by all scratch folders"""
+        total = 0
+        for folder in cls.folders():
+            total += folder_size(folder)
+        return total
+
+    @classmethod
+    def _used(cls):
+        """Bytes counted against the quota, call with the lock held"""
+        if cls._reserved is None:
+            cls._reserved = cls.usage()
+        return cls._reserved
+
+    @classmethod
+    def check_quota(cls, extra=0):
+        with cls._lock:
+            usage = cls._used()
+        if usage + extra > cls.quota():
+            raise ScratchQuotaExceeded(usage + extra, cls.quota())
+
+    @classmethod
+    def reserve(cls, size):
+        """Count size bytes against the quota, raises if they don't fit"""
+        with cls._lock:
+            usage = cls._used()
+            if usage + size > cls.quota():
+                raise ScratchQuotaExceeded(usage + size, cls.quota())
+            cls._reserved = usage + size
+
+    @classmethod
+    def release(cls, size):
+        """Give back space from reserve once the files are gone"""
+        with cls._lock:
+            if cls._reserved is not None:
+                cls._reserved = max(cls._reserved - size, 0)
+
+    @classmethod
+    def clean_orphans(cls):
+        """Delete folders left behind by processes that aren't running anymore. Returns how many were removed"""
+        removed = 0
+        for folder in cls.folders():
+            try:
+                pid = int((folder / OWNER_FILE).read_text())
+            except (OSError, ValueError):
+                pid = None
+            if pid is None or not _pid_alive(pid):
+                shutil.rmtree(folder, ignore_errors=True)
+                removed += 1
+        return removed
+
+    @classmethod
+    def report(cls):
+        return {"location": str(cls.root()), "disk_location": str(cls.root(disk=True)), "folders": len(cls.folders()),
+                "usage": cls.usage(), "quota": cls.quota()}
 
 
 class TempFolder:
-    def __init__(self, name=None):
+    def __init__(self, name=None, disk=False):
+        """disk puts the folder somewhere backed by a disk instead of memory, for big files"""
         if name is None:
             name = consts.bot_name + "temp"
-        self.name = name
-        self.folder = _OSTempLocation.temp_location() / self.name
-        if self.folder.exists():
-            print("Deleting existing temp folder...")
-            shutil.rmtree(self.folder)
-        os.mkdir(self.folder)
+        ScratchSpace.check_quota()
+        # Space reserved for files written with write, given back when the folder is deleted
+        self._reserved = 0
+        self.folder = Path(tempfile.mkdtemp(prefix=f"{name}-", dir=ScratchSpace.root(disk)))
+        self.name = self.folder.name
+        (self.folder / OWNER_FILE).write_text(str(os.getpid()))
 
     def __enter__(self) -> Path:
         return self.folder
@@ -43,5 +170,44 @@ class TempFolder:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def write(self, name, filestream) -> Path:
+        """Copy a filestream into the folder, as long as it fits in the quota"""
+        filestream.seek(0, 2)
+        size = filestream.tell()
+        ScratchSpace.reserve(size)
+        self._reserved += size
+        filestream.seek(0)
+        path = self.folder / name
+        with open(path, "wb") as f:
+            shutil.copyfileobj(filestream, f)
+        filestream.seek(0)
+        return path
+
     def close(self):
-        shutil.rmtree(self.folder)
+        shutil.rmtree(self.folder, ignore_errors=True)
+        ScratchSpace.release(self._reserved)
+        self._reserved = 0
+
+
+def folder_size(folder):
+    total = 0
+    for path, _, files in os.walk(folder):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(path, f))
+            except OSError:     # Deleted while we were looking
+                pass
+    return total
+
+
+def _pid_alive(pid):
+    if platform.system() == "Windows":
+        # No cheap check, leave it alone
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True